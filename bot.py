@@ -16,13 +16,15 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
 )
+from config_store import config_store
+from control import DAEMON_SOCKET, daemon_running, request_stop, send_command, start_daemon
+from rate_limit import BACKGROUND, INTERACTIVE
 
 # Configuration
-CONFIG_FILE = "config.json"
 BOT_FILE = "bot.json"
 SESSION_FILE = "anon.session"
 STATE_FILE = "clone_state.json"
-STOP_FILE = "stop.flag"
+WORKER_LOG = "worker.log"
 
 # Load bot token
 with open(BOT_FILE) as f:
@@ -34,14 +36,13 @@ def log_error(msg):
         f.write(f"{datetime.now()}: {msg}\n")
 
 def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {}
-    with open(CONFIG_FILE) as f:
-        return json.load(f)
+    return config_store.load()
 
 def save_config(data):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    config_store.save(data)
+
+def ensure_config_key(key, value):
+    config_store.set(key, value)
 
 def save_clone_state(start_id=None, end_id=None):
     state = {
@@ -220,7 +221,7 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         client = context.user_data["client"]
         await client.sign_in(
-            phone=load_config()["phone"],
+            phone=config_store.get_str("phone"),
             code=code,
             phone_code_hash=context.user_data["phone_code_hash"]
         )
@@ -258,9 +259,16 @@ async def start_mission(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return MISSION
 
+async def run_worker(chat_id, start_id=None, end_id=None):
+    """Queue a clone job on the resident worker, starting it if needed"""
+    if not await daemon_running():
+        await start_daemon(WORKER_LOG)
+    priority = INTERACTIVE if start_id or end_id else BACKGROUND
+    await send_command("submit", DAEMON_SOCKET, chat_id=chat_id, start=start_id, end=end_id, priority=priority)
+
 async def full_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🚀 Starting full clone...")
-    os.system(f"python clone_worker.py --chat_id {update.effective_chat.id} &")
+    await run_worker(update.effective_chat.id)
     return MAIN_MENU
 
 async def request_range_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -281,7 +289,7 @@ async def set_range_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
         start_id = context.user_data["range_start"]
         end_id = int(update.message.text)
         await update.message.reply_text(f"🚀 Cloning {start_id} to {end_id}...")
-        os.system(f"python clone_worker.py --chat_id {update.effective_chat.id} --start {start_id} --end {end_id} &")
+        await run_worker(update.effective_chat.id, start_id, end_id)
         return MAIN_MENU
     except ValueError:
         await update.message.reply_text("❌ Must be a number. Try again:")
@@ -291,17 +299,13 @@ async def resume_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     state = load_clone_state()
     if state:
         await update.message.reply_text(f"🔄 Resuming from {state['last_start']}...")
-        os.system(
-            f"python clone_worker.py --chat_id {update.effective_chat.id} "
-            f"--start {state['last_start']} --end {state['last_end']} &"
-        )
+        await run_worker(update.effective_chat.id, state["last_start"], state["last_end"])
     else:
         await update.message.reply_text("⚠️ No clone to resume")
     return MAIN_MENU
 
 async def stop_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    with open(STOP_FILE, "w") as f:
-        f.write("stop")
+    await request_stop(DAEMON_SOCKET)
     save_clone_state(
         context.user_data.get("range_start"),
         context.user_data.get("range_end")
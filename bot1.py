@@ -16,15 +16,18 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
 )
+from config_store import CONFIG_FILE, config_store
+from control import DAEMON_SOCKET, SHUTDOWN_TIMEOUT, request_stop, send_command, start_daemon
+from progress import ProgressReader
+from rate_limit import BACKGROUND, INTERACTIVE
 
 # Configuration
-CONFIG_FILE = "config.json"
 BOT_FILE = "bot.json"
 SESSION_FILE = "anon.session"
 STATE_FILE = "clone_state.json"
 PROGRESS_FILE = "clone_progress.json"
+WORKER_LOG = "worker.log"
 STOP_FILE = "stop.flag"
-SENT_LOG = "sent_ids.txt"
 
 # Ensure required files exist
 for f in [CONFIG_FILE, BOT_FILE]:
@@ -44,29 +47,16 @@ def log_error(msg):
         f.write(f"{datetime.now()}: {msg}\n")
 
 def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {}
-    try:
-        with open(CONFIG_FILE) as f:
-            return json.load(f)
-    except:
-        return {}
+    return config_store.load()
 
 def save_config(data):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    config_store.save(data)
 
 def ensure_config_key(key, value):
-    config = load_config()
-    config[key] = value
-    save_config(config)
+    config_store.set(key, value)
 
 def get_progress():
-    try:
-        with open(PROGRESS_FILE) as f:
-            return json.load(f)
-    except:
-        return {"status": "inactive", "progress": 0, "total": 0, "current": "", "chat_id": None}
+    return progress_reader.snapshot
 
 def save_clone_state(start_id=None, end_id=None):
     state = {
@@ -138,22 +128,40 @@ def mission_menu(show_resume=False):
 
 # ---------------------- CLONE MANAGEMENT ----------------------
 clone_process = None
+progress_reader = ProgressReader()
 
-async def run_worker(chat_id, start_id=None, end_id=None):
-    """Run the clone worker in a subprocess"""
+async def ensure_daemon():
+    """Start the resident clone worker unless this bot already runs one"""
     global clone_process
-    args = ['python', 'clone_worker.py', '--chat_id', str(chat_id)]
-    if start_id:
-        args.extend(['--start', str(start_id)])
-    if end_id:
-        args.extend(['--end', str(end_id)])
-    
-    clone_process = await asyncio.create_subprocess_exec(
-        *args,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    return clone_process
+    if clone_process and clone_process.returncode is None:
+        return
+    # A daemon left by an earlier bot run has nobody reading its progress, so
+    # it is replaced; its running job stays queued and resumes in the new one
+    try:
+        await send_command("shutdown", DAEMON_SOCKET, timeout=SHUTDOWN_TIMEOUT)
+    except (OSError, ValueError, asyncio.TimeoutError):
+        pass
+
+    # Progress comes back as JSON lines on a pipe of its own; the worker's
+    # console output goes to a log file so it can never fill a pipe nobody reads
+    read_fd, write_fd = os.pipe()
+    try:
+        clone_process = await start_daemon(WORKER_LOG, '--progress_fd', str(write_fd), pass_fds=(write_fd,))
+    except Exception:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    progress_reader.follow(read_fd)
+
+async def run_worker(chat_id, start_id=None, end_id=None):
+    """Queue a clone job on the resident worker"""
+    await ensure_daemon()
+    # Range clones are someone waiting on a reply; full clones run in the background
+    priority = INTERACTIVE if start_id or end_id else BACKGROUND
+    reply = await send_command("submit", DAEMON_SOCKET, chat_id=chat_id, start=start_id, end=end_id,
+                               priority=priority)
+    return reply["job"]
 
 async def stop_clone_handler():
     """Gracefully stop the clone process"""
@@ -392,7 +400,7 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         client = context.user_data["client"]
         await client.sign_in(
-            phone=load_config()["phone"],
+            phone=config_store.get_str("phone"),
             code=code,
             phone_code_hash=context.user_data["phone_code_hash"]
         )
@@ -458,8 +466,7 @@ async def chat_shared_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def start_mission(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mission control menu"""
-    config = load_config()
-    if not all(k in config for k in ("source_channel_id", "target_channel_id")):
+    if not config_store.has("source_channel_id", "target_channel_id"):
         await update.message.reply_text(
             "⚠️ Please configure source and target channels first",
             reply_markup=main_menu()
@@ -547,8 +554,7 @@ async def resume_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def stop_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Stop current clone operation"""
-    with open(STOP_FILE, "w") as f:
-        f.write("stop")
+    await request_stop(DAEMON_SOCKET)
     
     if "range_start" in context.user_data:
         save_clone_state(
@@ -580,11 +586,6 @@ def main():
         print("❌ Error: No bot token found in bot.json")
         return
     
-    # Create required files if they don't exist
-    for f in [SENT_LOG, PROGRESS_FILE]:
-        if not os.path.exists(f):
-            open(f, 'w').close()
-    
     app = Application.builder().token(BOT_TOKEN).build()
     
     # Add global commands
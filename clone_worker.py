@@ -1,21 +1,35 @@
 import os
 import json
 import asyncio
+import argparse
 from telethon import TelegramClient, events
-from telethon.tl.functions.messages import GetHistoryRequest
-from tqdm import tqdm
+from telethon.errors import MessageIdInvalidError, MessageNotModifiedError
+from tqdm.asyncio import tqdm
 from datetime import datetime
+from history import MessageRef, chunked, count_history, fetch_messages, stream_history
+from source_index import SourceIndex
+from spool import MEMORY_BUDGET, MEMORY_LIMIT, SPOOL_DIR, SPOOL_LIMIT, Spool
+from parallel_transfer import CONNECTIONS, PART_SIZE
+from pipeline import DOWNLOAD_WORKERS, STAGE_KINDS, UPLOAD_WORKERS, ClonePipeline
+from transfer import BULK_MODE, FORWARD_BATCH, REFERENCE_MODE, forward_batch
+from rate_limit import EDIT, SEND, RateLimiter, limited
+from retry import MAX_ATTEMPTS, DeadLetters, RetryScheduler
+from sessions import Account, SessionPool
+from sent_store import SentStore
+from id_map import IdMap
+from config_store import config_store
+from control import CONTROL_SOCKET, ControlServer, RunControl
+from progress import ProgressWriter
 
 # Config files
-CONFIG_FILE = "config.json"
 BOT_FILE = "bot.json"
 SESSION_FILE = "anon.session"
-SENT_LOG = "sent_ids.txt"
 ERROR_LOG = "errors.txt"
-STOP_FILE = "stop.flag"
+
+# Status message edits
+STATUS_INTERVAL = 3
 
 # Initialize files
-open(SENT_LOG, 'a').close()
 open(ERROR_LOG, 'a').close()
 
 def log_error(msg):
@@ -37,7 +51,12 @@ class CloneBot:
         self.allowed_users = set()
         self.current_status = "Idle"
         self.last_update = None
-        self.message_queue = asyncio.Queue()
+        self.control = None
+        self.progress = ProgressWriter()
+        self.limiter = RateLimiter()
+        self.status_interval = config_store.get_float("status_interval", STATUS_INTERVAL)
+        self.published_text = None
+        self.publisher = None
 
     async def initialize(self):
         bot_config = load_json(BOT_FILE)
@@ -50,17 +69,18 @@ class CloneBot:
 
         self.bot_client = TelegramClient(
             'bot_session',
-            load_json(CONFIG_FILE)["api_id"],
-            load_json(CONFIG_FILE)["api_hash"]
+            config_store.get_int("api_id"),
+            config_store.get_str("api_hash"),
+            flood_sleep_threshold=0
         )
 
         @self.bot_client.on(events.NewMessage())
         async def message_handler(event):
             if event.sender_id in self.allowed_users:
-                await self.message_queue.put(event)
+                await self.handle_message(event)
 
         await self.bot_client.start(bot_token=bot_config["bot_token"])
-        self.status_chat_id = next(iter(self.allowed_users))
+        self.status_chat_id = self.status_chat_id or next(iter(self.allowed_users))
         return True
 
     async def send_initial_status(self):
@@ -78,48 +98,92 @@ class CloneBot:
         except Exception as e:
             log_error(f"Initial status send failed: {str(e)}")
 
-    async def update_status(self, message):
+    async def update_status(self, message, wait=False):
+        """Record the latest status; the publisher edits it in, or right away with wait=True"""
+        if message != self.current_status:
+            self.current_status = message
+            self.last_update = datetime.now().strftime("%H:%M:%S")
+        if wait:
+            await self.publish()
+        elif self.publisher is None or self.publisher.done():
+            self.publisher = asyncio.create_task(self.publish_loop())
+
+    def render_status(self):
+        return (
+            f"🔄 {self.current_status}\n"
+            f"⏰ Last Update: {self.last_update}"
+        )
+
+    async def publish_loop(self):
+        """Coalesce status changes into at most one edit per status_interval"""
+        while True:
+            await asyncio.sleep(self.status_interval)
+            await self.publish()
+
+    async def publish(self):
         if not self.bot_client or not self.status_chat_id:
             return
+        text = self.render_status()
+        if text == self.published_text:
+            return
 
-        self.current_status = message
-        self.last_update = datetime.now().strftime("%H:%M:%S")
-        
         try:
             if self.status_message_id:
-                await self.bot_client.edit_message(
+                await self.limiter.call(
+                    EDIT,
+                    self.bot_client.edit_message,
                     self.status_chat_id,
                     self.status_message_id,
-                    f"🔄 {message}\n"
-                    f"⏰ Last Update: {self.last_update}"
+                    text,
+                    retries=0
                 )
             else:
-                msg = await self.bot_client.send_message(
-                    self.status_chat_id,
-                    f"🔄 {message}\n"
-                    f"⏰ Last Update: {self.last_update}"
-                )
+                msg = await self.bot_client.send_message(self.status_chat_id, text)
                 self.status_message_id = msg.id
                 self.status_chat_id = msg.chat_id
+            self.published_text = text
+        except MessageNotModifiedError:
+            self.published_text = text
+        except MessageIdInvalidError:
+            # The status message was deleted; the next publish sends a new one
+            self.status_message_id = None
         except Exception as e:
+            # Anything else (FloodWait included) is retried on the next tick
             log_error(f"Status update failed: {str(e)}")
-            self.status_message_id = None
 
-    async def handle_messages(self):
-        while self.is_cloning:
-            try:
-                event = await asyncio.wait_for(self.message_queue.get(), timeout=0.1)
-                if event.text == '/status':
-                    await event.reply(f"Current Status:\n{self.current_status}\nLast Update: {self.last_update}")
-                elif event.text == '/stop':
-                    open(STOP_FILE, 'a').close()
-                    await event.reply("🛑 Stop request received. Operation will halt after current message.")
-            except asyncio.TimeoutError:
-                continue
-            except Exception as e:
-                log_error(f"Message handling error: {str(e)}")
+    async def handle_message(self, event):
+        try:
+            if event.text == '/status':
+                await event.reply(f"Current Status:\n{self.current_status}\nLast Update: {self.last_update}")
+            elif event.text == '/stop' and self.control:
+                self.control.stop()
+                await event.reply("🛑 Stopped. Transfers in flight were cancelled.")
+            elif event.text == '/pause' and self.control:
+                self.control.pause()
+                await event.reply("⏸ Paused. Send /resume to continue.")
+            elif event.text == '/resume' and self.control:
+                self.control.resume()
+                await event.reply("▶️ Resumed.")
+        except Exception as e:
+            log_error(f"Message handling error: {str(e)}")
+
+    def for_job(self, job_id, chat_id=None):
+        """Status reporting for one of several concurrent jobs, through this bot's client"""
+        reporter = CloneBot()
+        reporter.bot_client = self.bot_client
+        reporter.allowed_users = self.allowed_users
+        reporter.limiter = self.limiter
+        reporter.status_chat_id = chat_id or self.status_chat_id
+        reporter.progress = self.progress.for_job(job_id)
+        return reporter
+
+    def stop_publishing(self):
+        if self.publisher:
+            self.publisher.cancel()
 
     async def cleanup(self):
+        self.stop_publishing()
+        self.progress.close()
         if self.bot_client:
             await self.bot_client.disconnect()
 
@@ -135,7 +199,6 @@ async def live_updates():
                 return False
             
         await bot.send_initial_status()
-        asyncio.create_task(bot.handle_messages())
         await bot.update_status("🔌 Reconnected live updates to existing clone operation")
         return True
     else:
@@ -146,130 +209,331 @@ async def live_updates():
         
         await bot.send_initial_status()
         bot.is_cloning = True
-        asyncio.create_task(bot.handle_messages())
         return True
-async def clone_worker(start_id=None, end_id=None):
+
+async def bulk_clone(client, src_entity, tgt_entity, refs, total_messages, drop_captions=False, limiter=None,
+                     dead_letters=None, attempts=MAX_ATTEMPTS, accounts=None, sent_store=None, id_map=None,
+                     control=None, reporter=None):
+    """Copy messages FORWARD_BATCH at a time with ForwardMessages"""
+    reporter = reporter or bot
+    processed = 0
+    pbar = tqdm(desc="Cloning", total=total_messages)
+    dead_letters = dead_letters or DeadLetters()
+    accounts = accounts or SessionPool([Account(client, src_entity, tgt_entity, limiter, primary=True)])
+    sent_store = sent_store or SentStore(src_entity.id, tgt_entity.id)
+    control = control or RunControl()
+
+    async def send(batch, kind=None):
+        nonlocal processed
+        # Each batch goes through whichever account can send soonest
+        account = accounts.pick(SEND)
+        sent = await limited(account.limiter, SEND, forward_batch, account.client, account.source, account.target,
+                             [ref.id for ref in batch], drop_captions)
+
+        if id_map:
+            id_map.add((ref.id, sent[ref.id], ref.grouped_id) for ref in batch if ref.id in sent)
+        sent_store.add(*sent)
+
+        processed += len(sent)
+        pbar.update(len(batch))
+        reporter.progress.tick(processed, total_messages, f"Message {batch[-1].id}")
+        percent = (processed / max(total_messages, processed)) * 100
+        await reporter.update_status(
+            f"⏳ Cloning: {percent:.1f}% complete\n"
+            f"({processed}/{total_messages} messages)"
+        )
+
+    async def give_up(batch, e):
+        log_error(f"Batch {batch[0].id}-{batch[-1].id} failed: {str(e)}")
+        for ref in batch:
+            dead_letters.add(src_entity.id, tgt_entity.id, ref.id, e)
+        await reporter.update_status(f"⚠️ Error on batch {batch[0].id}-{batch[-1].id} (continuing)")
+
+    retries = RetryScheduler(send, give_up, client, attempts)
+
+    async def forward_all():
+        async for batch in chunked(refs, FORWARD_BATCH):
+            await control.wait()
+            try:
+                await send(batch)
+            except Exception as e:
+                await retries.failed(batch, e)
+        await retries.drain()
+
+    # A stop cancels the batch in flight instead of waiting for it
+    task = asyncio.create_task(forward_all())
+    control.on_stop(task.cancel)
+    control.on_stop(retries.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        if not control.stopped:
+            raise
+    pbar.close()
+    return processed
+
+async def replay_refs(ids):
+    """MessageRefs for a list of IDs, in the shape stream_history yields them"""
+    for msg_id in ids:
+        yield MessageRef(msg_id)
+
+async def skip_sent(refs, sent_store):
+    """Drop refs the target already has"""
+    async for ref in refs:
+        if ref.id not in sent_store:
+            yield ref
+
+def config_spool(config):
+    """The spool the config asks for"""
+    return Spool(
+        config.get("spool_dir", SPOOL_DIR),
+        config.get("spool_limit_mb", SPOOL_LIMIT // 2**20) * 2**20,
+        config.get("memory_limit_mb", MEMORY_LIMIT // 2**20) * 2**20,
+        config.get("memory_budget_mb", MEMORY_BUDGET // 2**20) * 2**20
+    )
+
+REQUIRED_CONFIG = ["api_id", "api_hash", "phone", "source_channel_id", "target_channel_id"]
+
+def normalize_channel_id(cid):
+    cid = str(cid)
+    return int(cid) if cid.startswith("-100") else int("-100" + cid)
+
+async def connect_accounts(config):
+    """Log in the main session and any extra ones, resolving both channels for each"""
+    # FloodWaits reach the limiter instead of being slept through inside Telethon
+    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"], flood_sleep_threshold=0)
+    await client.start(phone=config["phone"])
+    limiter = RateLimiter(config.get("rate_limits"))
+
+    try:
+        src_entity = await client.get_entity(normalize_channel_id(config["source_channel_id"]))
+        tgt_entity = await client.get_entity(normalize_channel_id(config["target_channel_id"]))
+    except Exception:
+        await client.disconnect()
+        raise
+
+    # Extra accounts share the send load; each must already be logged in
+    # and be an admin of the target channel
+    accounts = SessionPool([Account(client, src_entity, tgt_entity, limiter, primary=True)])
+    for extra in config.get("sessions", []):
+        extra_client = TelegramClient(extra["session"], config["api_id"], config["api_hash"], flood_sleep_threshold=0)
+        try:
+            await extra_client.connect()
+            if not await extra_client.is_user_authorized():
+                raise ValueError("session is not logged in")
+            accounts.add(Account(
+                extra_client,
+                await extra_client.get_entity(normalize_channel_id(config["source_channel_id"])),
+                await extra_client.get_entity(normalize_channel_id(config["target_channel_id"])),
+                RateLimiter(config.get("rate_limits"))
+            ))
+        except Exception as e:
+            log_error(f"Session {extra['session']} unavailable: {str(e)}")
+            await extra_client.disconnect()
+    return accounts
+
+async def close_accounts(accounts):
+    await accounts.close()
+    await accounts.primary.client.disconnect()
+
+async def clone_worker(start_id=None, end_id=None, replay=False):
     if not bot.is_cloning:
         if not await live_updates():
             return
 
-    config = load_json(CONFIG_FILE)
-    if not all(k in config for k in ["api_id", "api_hash", "phone", "source_channel_id", "target_channel_id"]):
+    config = config_store.load()
+    if not all(k in config for k in REQUIRED_CONFIG):
         await bot.update_status("❌ Missing configuration")
+        bot.progress.status("error", current="Missing configuration")
         bot.is_cloning = False
         await bot.cleanup()
         return
 
-    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"])
-    await client.start(phone=config["phone"])
-    
     await bot.update_status("🚀 Starting cloning process...")
-
-    def normalize_channel_id(cid):
-        cid = str(cid)
-        return int(cid) if cid.startswith("-100") else int("-100" + cid)
-
     try:
-        src_entity = await client.get_entity(normalize_channel_id(config["source_channel_id"]))
-        tgt_entity = await client.get_entity(normalize_channel_id(config["target_channel_id"]))
+        accounts = await connect_accounts(config)
     except Exception as e:
         await bot.update_status(f"❌ Channel access failed: {str(e)}")
+        bot.progress.status("error", current=f"Channel access failed: {str(e)}")
         bot.is_cloning = False
-        await client.disconnect()
         await bot.cleanup()
         return
 
-    # Message collection
-    await bot.update_status("📂 Collecting messages...")
-    all_messages = []
-    offset_id = 0
-    limit = 100
-    
-    while True:
-        if os.path.exists(STOP_FILE):
-            await bot.update_status("⛔ Stopped by user request")
-            os.remove(STOP_FILE)
-            break
-
-        try:
-            history = await client(GetHistoryRequest(
-                peer=src_entity,
-                offset_id=offset_id,
-                offset_date=None,
-                add_offset=0,
-                limit=limit,
-                max_id=0,
-                min_id=0,
-                hash=0
-            ))
-            if not history.messages:
-                break
-                
-            all_messages.extend(history.messages)
-            offset_id = history.messages[-1].id
-            
-            if len(all_messages) % 100 == 0:
-                await bot.update_status(f"📥 Collected {len(all_messages)} messages")
-                
-        except Exception as e:
-            await bot.update_status(f"❌ Collection error: {str(e)}")
-            break
+    await run_clone(accounts, config, start_id, end_id, replay)
+    bot.is_cloning = False
+    await close_accounts(accounts)
+    await bot.cleanup()
 
-    all_messages.reverse()
-    if start_id and end_id:
-        all_messages = [msg for msg in all_messages if start_id <= msg.id <= end_id]
+async def run_clone(accounts, config, start_id=None, end_id=None, replay=False, control=None, reporter=None,
+                    spool=None):
+    """Clone one range through already connected accounts; returns how many messages were sent"""
+    # Concurrent runs pass one shared spool, so its cap holds across all of
+    # them and a document's spool file is only ever in one transfer
+    # Without a control from the caller the run makes its own and serves it
+    # on the control socket; status goes to `reporter`, the live bot by default
+    reporter = reporter or bot
+    own_control = control is None
+    client = accounts.primary.client
+    limiter = accounts.primary.limiter
+    src_entity = accounts.primary.source
+    tgt_entity = accounts.primary.target
+    if len(accounts) > 1:
+        await reporter.update_status(f"👥 Sending through {len(accounts)} accounts")
+
+    # Message collection runs alongside cloning; already indexed IDs are
+    # read locally and only history above the high-water mark is paged.
+    # The stream carries compact MessageRefs, and full messages are fetched
+    # in small batches right before sending.
+    index = SourceIndex(src_entity.id)
+    id_map = IdMap(src_entity.id, tgt_entity.id)
+    sent_store = SentStore(src_entity.id, tgt_entity.id, id_map=id_map)
+    dead_letters = DeadLetters()
+    replay_ids = []
+    control_server = None
+    try:
+        attempts = config.get("retry_attempts", MAX_ATTEMPTS)
+        if replay:
+            # Replaying clones only what was dead-lettered. Entries stay listed
+            # until their message is in the sent store, so a stopped or crashed
+            # replay (pending retries included) leaves the rest for the next one
+            replay_ids = dead_letters.ids(src_entity.id, tgt_entity.id)
+            dead_letters.remove(src_entity.id, tgt_entity.id,
+                                [msg_id for msg_id in replay_ids if msg_id in sent_store])
+            replay_ids = [msg_id for msg_id in replay_ids if msg_id not in sent_store]
+            total_messages = len(replay_ids)
+        else:
+            try:
+                total_messages = await count_history(client, src_entity, start_id or 0, end_id or 0, limiter)
+                total_messages = max(0, total_messages - sent_store.count(start_id or 0, end_id or 0))
+            except Exception as e:
+                await reporter.update_status(f"❌ Collection error: {str(e)}")
+                total_messages = 0
 
-    total_messages = len(all_messages)
-    processed = 0
+        processed = 0
     
-    await bot.update_status(f"📊 Ready to clone {total_messages} messages")
-
-    # Cloning process
-    progress_interval = (1)
+        await reporter.update_status(f"📊 Streaming {total_messages} messages")
+        reporter.progress.status("active", progress=0, total=total_messages, chat_id=reporter.status_chat_id)
+
+        # The bot steers the run over a control socket; stop, pause and resume
+        # act immediately, rate retunes every account's limiter, and
+        # concurrency sets how many download or upload workers run
+        control = control or RunControl()
+        reporter.control = control
+
+        async def on_command(command):
+            cmd = command.get("cmd")
+            if cmd == "stop":
+                control.stop()
+            elif cmd == "pause":
+                control.pause()
+            elif cmd == "resume":
+                control.resume()
+            elif cmd in ("rate", "concurrency"):
+                value = command.get("value")
+                kind = command.get("kind", SEND)
+                if cmd == "concurrency":
+                    if kind not in STAGE_KINDS:
+                        return {"ok": False, "error": f"Concurrency applies to {' and '.join(STAGE_KINDS)} only"}
+                    if not control.resize(kind, value):
+                        return {"ok": False, "error": "This run has no download or upload stage"}
+                for account in accounts.accounts:
+                    await account.limiter.configure(
+                        kind,
+                        rate=value if cmd == "rate" else None,
+                        concurrency=value if cmd == "concurrency" else None
+                    )
+            elif cmd != "status":
+                return {"ok": False, "error": f"Unknown command: {cmd}"}
+            return {"ok": True, "status": reporter.current_status, "paused": control.paused, "stopped": control.stopped}
+
+        if own_control:
+            control_server = await ControlServer(on_command, config.get("control_socket", CONTROL_SOCKET)).start()
+
+        # Cloning process
+        transfer_mode = config.get("transfer_mode", REFERENCE_MODE)
     
-    for msg in tqdm(all_messages, desc="Cloning"):
-        if os.path.exists(STOP_FILE):
-            await bot.update_status(f"⛔ Stopped ({processed}/{total_messages} done)")
-            os.remove(STOP_FILE)
-            break
+        if replay:
+            refs = replay_refs(replay_ids)
+        else:
+            refs = skip_sent(stream_history(client, src_entity, start_id or 0, end_id or 0, index=index,
+                                            limiter=limiter), sent_store)
+        if transfer_mode == BULK_MODE and not getattr(src_entity, "noforwards", False):
+            processed = await bulk_clone(client, src_entity, tgt_entity, refs, total_messages,
+                                         config.get("drop_captions", False), limiter, dead_letters, attempts, accounts,
+                                         sent_store, id_map, control, reporter)
+        else:
+            pipeline = ClonePipeline(
+                client, src_entity, tgt_entity, transfer_mode,
+                downloads=config.get("download_workers", DOWNLOAD_WORKERS),
+                uploads=config.get("upload_workers", UPLOAD_WORKERS),
+                connections=config.get("download_connections", CONNECTIONS),
+                part_size=config.get("part_size_kb", PART_SIZE // 1024) * 1024,
+                upload_connections=config.get("upload_connections", CONNECTIONS),
+                spool=spool or config_spool(config),
+                limiter=limiter,
+                attempts=attempts,
+                accounts=accounts,
+                id_map=id_map,
+                control=control
+            )
 
-        try:
-            if msg.media:
-                file_path = await client.download_media(msg)
-                await client.send_file(tgt_entity, file_path, caption=msg.text or msg.message or "")
-                os.remove(file_path)
-            elif msg.text or msg.message:
-                await client.send_message(tgt_entity, msg.text or msg.message)
-
-            with open(SENT_LOG, "a") as f:
-                f.write(f"{msg.id}\n")
-
-            processed += 1
-            if processed % progress_interval == 0 or processed == total_messages:
-                percent = (processed / total_messages) * 100
-                await bot.update_status(
+            async def on_commit(msg):
+                nonlocal processed
+                sent_store.add(msg.id)
+
+                processed += 1
+                reporter.progress.tick(processed, total_messages, f"Message {msg.id}")
+                # Cheap: the status publisher coalesces these into periodic edits
+                percent = (processed / max(total_messages, processed)) * 100
+                await reporter.update_status(
                     f"⏳ Cloning: {percent:.1f}% complete\n"
                     f"({processed}/{total_messages} messages)\n"
                     f"⏱️ ~{(total_messages - processed)//2}s remaining"
                 )
 
-            await asyncio.sleep(0.5)
+            async def on_error(msg, e):
+                log_error(f"Message {msg.id} failed: {str(e)}")
+                dead_letters.add(src_entity.id, tgt_entity.id, msg.id, e)
+                await reporter.update_status(f"⚠️ Error on message {msg.id} (continuing)")
 
-        except Exception as e:
-            log_error(f"Message {msg.id} failed: {str(e)}")
-            if processed % 1 == 0:
-                await bot.update_status(f"⚠️ Error on message {msg.id} (continuing)")
-
-    # Final status
-    completion_msg = f"✅ Completed: {processed}/{total_messages} messages"
-    if os.path.exists(STOP_FILE):
-        completion_msg = f"⏹️ Stopped early: {processed}/{total_messages}"
-        os.remove(STOP_FILE)
+            pipeline.on_commit = on_commit
+            pipeline.on_error = on_error
+            try:
+                await pipeline.run(tqdm(fetch_messages(client, src_entity, refs, limiter=limiter),
+                                        desc="Cloning", total=total_messages))
+            except Exception as e:
+                log_error(f"Clone pipeline failed: {str(e)}")
+                await reporter.update_status(f"❌ Collection error: {str(e)}")
+
+        # Final status
+        completion_msg = f"✅ Completed: {processed}/{total_messages} messages"
+        if control.stopped:
+            completion_msg = f"⏹️ Stopped early: {processed}/{total_messages}"
         
-    await bot.update_status(completion_msg)
-    bot.is_cloning = False
-    await client.disconnect()
-    await bot.cleanup()
+        await reporter.update_status(completion_msg, wait=True)
+        reporter.progress.status("stopped" if control.stopped else "completed",
+                            progress=processed, total=total_messages, current="")
+    finally:
+        if replay:
+            dead_letters.remove(src_entity.id, tgt_entity.id,
+                                [msg_id for msg_id in replay_ids if msg_id in sent_store])
+        if control_server:
+            await control_server.close()
+        reporter.control = None
+        index.close()
+        sent_store.close()
+        id_map.close()
+    return processed
 
 if __name__ == "__main__":
-    asyncio.run(clone_worker())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat_id", type=int)
+    parser.add_argument("--start", type=int)
+    parser.add_argument("--end", type=int)
+    parser.add_argument("--replay", action="store_true", help="retry the dead-lettered messages")
+    parser.add_argument("--progress_fd", type=int, help="descriptor to write JSON-lines progress events to")
+    args = parser.parse_args()
+
+    bot.status_chat_id = args.chat_id
+    bot.progress = ProgressWriter(args.progress_fd)
+    asyncio.run(clone_worker(args.start, args.end, args.replay))
@@ -1,23 +1,23 @@
 import os
-import json
 import asyncio
 import argparse
 from datetime import datetime
 from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.types import Message
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
+from history import count_history, stream_history
+from rate_limit import DOWNLOAD, SEND, RateLimiter
+from retry import REFRESH, DeadLetters, RetryScheduler
+from sent_store import SentStore
+from config_store import config_store
 
 # Configuration
-CONFIG_FILE = "config.json"
 SESSION_FILE = "anon.session"
-SENT_LOG = "sent_ids.txt"
 STOP_FILE = "stop.flag"
 STATE_FILE = "clone_state.json"
 
 def load_config():
-    with open(CONFIG_FILE) as f:
-        return json.load(f)
+    return config_store.load()
 
 def normalize_channel_id(cid):
     cid = str(cid)
@@ -31,49 +31,48 @@ async def main():
     args = parser.parse_args()
 
     config = load_config()
-    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"])
+    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"], flood_sleep_threshold=0)
     await client.start(phone=config["phone"])
+    limiter = RateLimiter(config.get("rate_limits"))
 
     try:
         src_entity = await client.get_entity(normalize_channel_id(config["source_channel_id"]))
         tgt_entity = await client.get_entity(normalize_channel_id(config["target_channel_id"]))
 
-        with open(SENT_LOG, "r") as f:
-            sent_ids = set(map(int, f.read().split()))
-
-        offset_id = 0
-        limit = 100
-        all_messages = []
-
-        while True:
-            history = await client(GetHistoryRequest(
-                peer=src_entity,
-                offset_id=offset_id,
-                offset_date=None,
-                add_offset=0,
-                limit=limit,
-                max_id=0,
-                min_id=0,
-                hash=0
-            ))
-            if not history.messages:
-                break
-            all_messages.extend(history.messages)
-            offset_id = history.messages[-1].id
-
-        all_messages.reverse()
+        sent_store = SentStore(src_entity.id, tgt_entity.id)
 
-        if args.start or args.end:
-            all_messages = [msg for msg in all_messages 
-                          if (args.start is None or msg.id >= args.start) and 
-                             (args.end is None or msg.id <= args.end)]
+        total = await count_history(client, src_entity, args.start or 0, args.end or 0, limiter)
 
         progress_msg = await client.send_message(
             entity=args.chat_id,
             message="🔄 Cloning started..."
         )
 
-        for msg in tqdm(all_messages, desc="Cloning"):
+        dead_letters = DeadLetters()
+
+        async def copy(msg, kind=None):
+            if kind == REFRESH:
+                msg = await client.get_messages(src_entity, ids=msg.id) or msg
+            if msg.media:
+                file_path = await limiter.call(DOWNLOAD, client.download_media, msg)
+                await limiter.call(SEND, client.send_file, tgt_entity, file_path, caption=msg.text or "")
+                os.remove(file_path)
+            elif msg.text:
+                await limiter.call(SEND, client.send_message, tgt_entity, msg.text)
+
+            sent_store.add(msg.id)
+
+        async def give_up(msg, e):
+            dead_letters.add(src_entity.id, tgt_entity.id, msg.id, e)
+            await client.send_message(
+                entity=args.chat_id,
+                message=f"⚠️ Error at message {msg.id}: {str(e)[:100]}"
+            )
+
+        retries = RetryScheduler(copy, give_up, client)
+
+        async for msg in tqdm(stream_history(client, src_entity, args.start or 0, args.end or 0, limiter=limiter),
+                              desc="Cloning", total=total):
             if os.path.exists(STOP_FILE):
                 await client.send_message(
                     entity=args.chat_id,
@@ -81,27 +80,18 @@ async def main():
                 )
                 break
 
-            if not isinstance(msg, Message) or msg.id in sent_ids:
+            if not isinstance(msg, Message) or msg.id in sent_store:
                 continue
 
             try:
-                if msg.media:
-                    file_path = await client.download_media(msg)
-                    await client.send_file(tgt_entity, file_path, caption=msg.text or "")
-                    os.remove(file_path)
-                elif msg.text:
-                    await client.send_message(tgt_entity, msg.text)
-
-                with open(SENT_LOG, "a") as f:
-                    f.write(f"{msg.id}\n")
-
-                await asyncio.sleep(1)
-
+                await copy(msg)
             except Exception as e:
-                await client.send_message(
-                    entity=args.chat_id,
-                    message=f"⚠️ Error at message {msg.id}: {str(e)[:100]}"
-                )
+                await retries.failed(msg, e)
+
+        if os.path.exists(STOP_FILE):
+            retries.cancel()
+        await retries.drain()
+        sent_store.close()
 
         await client.send_message(
             entity=args.chat_id,
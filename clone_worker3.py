@@ -4,27 +4,32 @@ import asyncio
 import argparse
 from datetime import datetime
 from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest
 from telethon.tl.types import Message
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
+from history import count_history, stream_history
+from rate_limit import DOWNLOAD, SEND, RateLimiter
+from retry import REFRESH, DeadLetters, RetryScheduler
+from sent_store import SentStore
+from config_store import config_store
 
 # Configuration
-CONFIG_FILE = "config.json"
 SESSION_FILE = "anon.session"
-SENT_LOG = "sent_ids.txt"
 STOP_FILE = "stop.flag"
 PROGRESS_FILE = "clone_progress.json"
 
+def progress_record(chat_id, current, total, current_file=""):
+    return {
+        "status": "active",
+        "chat_id": chat_id,
+        "progress": current,
+        "total": total,
+        "current_file": current_file,
+        "timestamp": datetime.now().isoformat()
+    }
+
 def update_progress(chat_id, current, total, current_file=""):
     with open(PROGRESS_FILE, "w") as f:
-        json.dump({
-            "status": "active",
-            "chat_id": chat_id,
-            "progress": current,
-            "total": total,
-            "current_file": current_file,
-            "timestamp": datetime.now().isoformat()
-        }, f)
+        json.dump(progress_record(chat_id, current, total, current_file), f)
 
 def clear_progress():
     with open(PROGRESS_FILE, "w") as f:
@@ -37,9 +42,10 @@ async def main():
     parser.add_argument("--end", type=int)
     args = parser.parse_args()
 
-    config = json.load(open(CONFIG_FILE))
-    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"])
+    config = config_store.load()
+    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"], flood_sleep_threshold=0)
     await client.start(phone=config["phone"])
+    limiter = RateLimiter(config.get("rate_limits"))
 
     try:
         # Initialize progress
@@ -52,59 +58,59 @@ async def main():
 
         src = await client.get_entity(normalize_id(config["source_channel_id"]))
         tgt = await client.get_entity(normalize_id(config["target_channel_id"]))
+        # Per-message progress goes through the sent store's journal, which
+        # refreshes PROGRESS_FILE once per group commit
+        sent_store = SentStore(src.id, tgt.id, progress_file=PROGRESS_FILE)
 
-        # Get message history
-        all_messages = []
-        offset_id = 0
-        while True:
-            history = await client(GetHistoryRequest(
-                peer=src,
-                offset_id=offset_id,
-                limit=100,
-                hash=0
-            ))
-            if not history.messages:
-                break
-            all_messages.extend(history.messages)
-            offset_id = history.messages[-1].id
+        # Stream message history while cloning
+        total = await count_history(client, src, args.start or 0, args.end or 0, limiter)
+        update_progress(args.chat_id, 0, total)
 
-        all_messages.reverse()
+        dead_letters = DeadLetters()
 
-        # Filter by range if specified
-        if args.start or args.end:
-            all_messages = [m for m in all_messages 
-                           if (args.start is None or m.id >= args.start) and 
-                              (args.end is None or m.id <= args.end)]
+        async def copy(msg, kind=None):
+            if kind == REFRESH:
+                msg = await client.get_messages(src, ids=msg.id) or msg
+            if msg.media:
+                file_path = await limiter.call(DOWNLOAD, client.download_media, msg)
+                await limiter.call(SEND, client.send_file, tgt, file_path, caption=msg.text or "")
+                os.remove(file_path)
+            elif msg.text:
+                await limiter.call(SEND, client.send_message, tgt, msg.text)
 
-        total = len(all_messages)
-        update_progress(args.chat_id, 0, total)
+            sent_store.add(msg.id)
+
+        async def give_up(msg, e):
+            dead_letters.add(src.id, tgt.id, msg.id, e)
+            await client.send_message(
+                args.chat_id,
+                f"⚠️ Error copying {msg.id}: {str(e)[:100]}"
+            )
+
+        retries = RetryScheduler(copy, give_up, client)
 
         # Clone messages
-        for i, msg in enumerate(tqdm(all_messages, desc="Cloning")):
+        i = 0
+        async for msg in tqdm(stream_history(client, src, args.start or 0, args.end or 0, limiter=limiter),
+                              desc="Cloning", total=total):
             if os.path.exists(STOP_FILE):
                 await client.send_message(args.chat_id, "⏸ Clone paused by user")
                 break
 
-            update_progress(args.chat_id, i+1, total, f"Message {msg.id}")
+            i += 1
+            if msg.id in sent_store:
+                continue
+            sent_store.add(progress=progress_record(args.chat_id, i, total, f"Message {msg.id}"))
 
             try:
-                if msg.media:
-                    file_path = await client.download_media(msg)
-                    await client.send_file(tgt, file_path, caption=msg.text or "")
-                    os.remove(file_path)
-                elif msg.text:
-                    await client.send_message(tgt, msg.text)
-
-                with open(SENT_LOG, "a") as f:
-                    f.write(f"{msg.id}\n")
-
-                await asyncio.sleep(1)
-
+                await copy(msg)
             except Exception as e:
-                await client.send_message(
-                    args.chat_id,
-                    f"⚠️ Error copying {msg.id}: {str(e)[:100]}"
-                )
+                await retries.failed(msg, e)
+
+        if os.path.exists(STOP_FILE):
+            retries.cancel()
+        await retries.drain()
+        sent_store.close()
 
         await client.send_message(args.chat_id, "✅ Clone completed!")
         clear_progress()
@@ -7,23 +7,21 @@ import json
 from datetime import datetime
 from telethon import TelegramClient, events
 from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
+from sent_store import SentStore
+from config_store import config_store
 
 # Configuration files
-CONFIG_FILE = "config.json"
 SESSION_FILE = "anon.session"
 PROGRESS_FILE = "clone_progress.json"
 STOP_FILE = "stop.flag"
 
 def load_config():
     """Load configuration from file"""
-    if not os.path.exists(CONFIG_FILE):
-        return None
-    with open(CONFIG_FILE) as f:
-        return json.load(f)
+    return config_store.load()
 
-def save_progress(status, progress, total, current, chat_id):
-    """Save cloning progress"""
-    data = {
+def progress_record(status, progress, total, current, chat_id):
+    """Build a progress entry"""
+    return {
         "status": status,
         "progress": progress,
         "total": total,
@@ -31,8 +29,11 @@ def save_progress(status, progress, total, current, chat_id):
         "timestamp": datetime.now().isoformat(),
         "chat_id": chat_id
     }
+
+def save_progress(status, progress, total, current, chat_id):
+    """Save cloning progress"""
     with open(PROGRESS_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+        json.dump(progress_record(status, progress, total, current, chat_id), f, indent=2)
 
 def should_stop():
     """Check if cloning should stop"""
@@ -81,20 +82,25 @@ async def clone_range(client, source_id, target_id, start_id=None, end_id=None):
     if not end_id:
         end_id = total_messages
 
+    # Sent IDs and progress share one group-committed journal, so a crash
+    # resumes exactly after the last committed message
+    sent_store = SentStore(source_entity.id, target_entity.id, progress_file=PROGRESS_FILE)
     cloned_count = 0
     for msg_id in range(start_id, end_id + 1):
         if should_stop():
+            sent_store.close()
             save_progress("paused", cloned_count, total_messages, msg_id, target_id)
             return
 
+        if msg_id in sent_store:
+            continue
+
         success = await clone_message(client, source_entity, target_entity, msg_id)
         if success:
             cloned_count += 1
+            sent_store.add(msg_id, progress=progress_record("active", cloned_count, total_messages, msg_id, target_id))
 
-        # Update progress every 10 messages
-        if msg_id % 10 == 0:
-            save_progress("active", cloned_count, total_messages, msg_id, target_id)
-
+    sent_store.close()
     save_progress("completed", cloned_count, total_messages, end_id, target_id)
 
 async def main():
@@ -1,20 +1,20 @@
 import os
-import json
-import asyncio
 from telethon import TelegramClient
-from telethon.tl.functions.messages import GetHistoryRequest, UpdatePinnedMessageRequest
+from telethon.tl.functions.messages import UpdatePinnedMessageRequest
 from telethon.tl.types import Message
-from tqdm import tqdm
+from tqdm.asyncio import tqdm
+from history import count_history, stream_history
+from rate_limit import DOWNLOAD, SEND, RateLimiter
+from retry import REFRESH, DeadLetters, RetryScheduler
+from sent_store import SentStore
+from config_store import config_store
 
-CONFIG_FILE = "config.json"
 SESSION_FILE = "anon"
-SENT_LOG = "sent_ids.txt"
 ERROR_LOG = "errors.txt"
 STOP_FILE = "stop.flag"
 START_FILE = "start.flag"
 RESUME_FILE = "resume.flag"
 
-open(SENT_LOG, "a").close()
 open(ERROR_LOG, "a").close()
 
 def log_error(msg):
@@ -22,20 +22,17 @@ def log_error(msg):
         f.write(msg + "\n")
 
 def load_json():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    return config_store.load()
 
 def save_json(data):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    config_store.save(data)
 
 async def clone_worker(start_id=None, end_id=None):
     
     config = load_json()
-    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"])
+    client = TelegramClient(SESSION_FILE, config["api_id"], config["api_hash"], flood_sleep_threshold=0)
     await client.start(phone=config["phone"])
+    limiter = RateLimiter(config.get("rate_limits"))
     
     def normalize_channel_id(cid):
         cid = str(cid)
@@ -44,60 +41,50 @@ async def clone_worker(start_id=None, end_id=None):
     src_entity = await client.get_entity(normalize_channel_id(config["source_channel_id"]))
     tgt_entity = await client.get_entity(normalize_channel_id(config["target_channel_id"]))
 
-    with open(SENT_LOG, "r") as f:
-        sent_ids = set(map(int, f.read().split()))
+    sent_store = SentStore(src_entity.id, tgt_entity.id)
 
-    offset_id = 0
-    limit = 100
-    all_messages = []
+    total = await count_history(client, src_entity, start_id or 0, end_id or 0, limiter)
+    dead_letters = DeadLetters()
 
-    while True:
-        history = await client(GetHistoryRequest(
-            peer=src_entity,
-            offset_id=offset_id,
-            offset_date=None,
-            add_offset=0,
-            limit=limit,
-            max_id=0,
-            min_id=0,
-            hash=0
-        ))
-        if not history.messages:
-            break
-        all_messages.extend(history.messages)
-        offset_id = history.messages[-1].id
+    async def copy(msg, kind=None):
+        if kind == REFRESH:
+            msg = await client.get_messages(src_entity, ids=msg.id) or msg
+        if msg.media:
+            file_path = await limiter.call(DOWNLOAD, client.download_media, msg)
+            await limiter.call(SEND, client.send_file, tgt_entity, file_path, caption=msg.text or msg.message or "")
+            os.remove(file_path)
+        elif msg.text or msg.message:
+            await limiter.call(SEND, client.send_message, tgt_entity, msg.text or msg.message)
+
+        sent_store.add(msg.id)
 
-    all_messages.reverse()
+    async def give_up(msg, e):
+        log_error(f"Failed to send message {msg.id}: {e}")
+        dead_letters.add(src_entity.id, tgt_entity.id, msg.id, e)
 
-    if start_id and end_id:
-        all_messages = [msg for msg in all_messages if start_id <= msg.id <= end_id]
+    retries = RetryScheduler(copy, give_up, client)
 
-    for msg in tqdm(all_messages, desc="Cloning"):
+    async for msg in tqdm(stream_history(client, src_entity, start_id or 0, end_id or 0, limiter=limiter),
+                          desc="Cloning", total=total):
         if os.path.exists(STOP_FILE):
             print("⛔ Stop file detected. Halting...")
             
             break
 
-        
+        if msg.id in sent_store:
+            continue
         
         try:
-            if msg.media:
-                file_path = await client.download_media(msg)
-                await client.send_file(tgt_entity, file_path, caption=msg.text or msg.message or "")
-                os.remove(file_path)
-            elif msg.text or msg.message:
-                await client.send_message(tgt_entity, msg.text or msg.message)
-
-            with open(SENT_LOG, "a") as f:
-                f.write(f"{msg.id}\n")
-
-            await asyncio.sleep(1)
-
+            await copy(msg)
         except Exception as e:
-            log_error(f"Failed to send message {msg.id}: {e}")
+            await retries.failed(msg, e)
         # Final cleanup if needed
         
     
+    if os.path.exists(STOP_FILE):
+        retries.cancel()
+    await retries.drain()
+    sent_store.close()
     print("✅ Cloning complete.")
     if os.path.exists("start.flag"):
         os.remove("start.flag")
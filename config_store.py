@@ -0,0 +1,107 @@
+import contextlib
+import copy
+import fcntl
+import json
+import os
+
+CONFIG_FILE = "config.json"
+
+
+class ConfigStore:
+    """config.json cached in memory, reloaded when the file changes and written atomically"""
+    # Reads cost one stat() while the file is unchanged; (mtime, size, inode)
+    # catches edits by other processes, and os.replace always makes a new
+    # inode. Writes re-read the file under an flock so two processes setting
+    # different keys never lose each other's change, and readers only ever
+    # see a whole file.
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self._data = {}
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _refresh(self):
+        stamp = self._stat()
+        if stamp != self._stamp:
+            self._data = self._read()
+            self._stamp = stamp
+        return self._data
+
+    def load(self):
+        """A copy of the whole config, safe to modify"""
+        return copy.deepcopy(self._refresh())
+
+    def get(self, key, default=None):
+        return copy.deepcopy(self._refresh().get(key, default))
+
+    def get_int(self, key, default=0):
+        try:
+            return int(self._refresh().get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_float(self, key, default=0.0):
+        try:
+            return float(self._refresh().get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_str(self, key, default=""):
+        value = self._refresh().get(key)
+        return default if value is None else str(value)
+
+    def has(self, *keys):
+        data = self._refresh()
+        return all(key in data for key in keys)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, data):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._data = data
+        self._stamp = self._stat()
+
+    def update(self, values=None, **kwargs):
+        """Set some keys, keeping whatever else is on disk"""
+        with self._locked():
+            data = self._read()
+            data.update(values or {}, **kwargs)
+            self._write(data)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def save(self, data):
+        """Replace the whole config"""
+        with self._locked():
+            self._write(copy.deepcopy(data))
+
+
+config_store = ConfigStore()
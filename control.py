@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+
+CONTROL_SOCKET = "clone.sock"
+DAEMON_SOCKET = "worker.sock"
+STOP_FILE = "stop.flag"
+COMMAND_TIMEOUT = 5
+DAEMON_START_TIMEOUT = 30
+SHUTDOWN_TIMEOUT = 120
+
+
+class RunControl:
+    """Stop/pause state of a running clone, checked in memory instead of on disk"""
+
+    def __init__(self):
+        self.stopped = False
+        self.running = asyncio.Event()
+        self.running.set()
+        self._on_stop = []
+        self._on_resize = []
+
+    def on_stop(self, callback):
+        self._on_stop.append(callback)
+
+    def on_resize(self, callback):
+        self._on_resize.append(callback)
+
+    def stop(self):
+        """Stop now, cancelling whatever is in flight"""
+        self.stopped = True
+        self.running.set()
+        for callback in self._on_stop:
+            callback()
+
+    def pause(self):
+        """Let in-flight work finish but start nothing new"""
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def resize(self, kind, count):
+        """Change how many workers a stage runs; False when nothing running has that stage"""
+        for callback in self._on_resize:
+            callback(kind, count)
+        return bool(self._on_resize)
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    async def wait(self):
+        await self.running.wait()
+
+
+class ControlServer:
+    """Unix socket taking one JSON command per line and answering with one JSON reply"""
+
+    def __init__(self, handler, path=CONTROL_SOCKET):
+        self.handler = handler
+        self.path = path
+        self.server = None
+
+    async def start(self):
+        # A socket file left by a crashed worker would make bind fail
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, self.path)
+        return self
+
+    async def _serve(self, reader, writer):
+        try:
+            async for line in reader:
+                try:
+                    reply = await self.handler(json.loads(line))
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def send_command(cmd, path=CONTROL_SOCKET, timeout=COMMAND_TIMEOUT, **args):
+    """Send one command to the running worker and return its reply"""
+    reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), timeout)
+    try:
+        writer.write((json.dumps({"cmd": cmd, **args}) + "\n").encode())
+        await writer.drain()
+        return json.loads(await asyncio.wait_for(reader.readline(), timeout))
+    finally:
+        writer.close()
+
+async def request_stop(path=CONTROL_SOCKET, flag_file=STOP_FILE):
+    """Stop the worker over the control socket, or leave the stop flag for one that only polls it"""
+    try:
+        return await send_command("stop", path)
+    except (OSError, ValueError, asyncio.TimeoutError):
+        with open(flag_file, "w") as f:
+            f.write("stop")
+        return None
+
+async def daemon_running(path=DAEMON_SOCKET):
+    try:
+        return (await send_command("ping", path)).get("ok", False)
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return False
+
+async def start_daemon(log_file, *args, path=DAEMON_SOCKET, pass_fds=(), timeout=DAEMON_START_TIMEOUT):
+    """Spawn worker_daemon.py and wait until it takes commands"""
+    with open(log_file, "a") as log:
+        process = await asyncio.create_subprocess_exec(
+            "python", "worker_daemon.py", *args,
+            stdout=log,
+            stderr=log,
+            pass_fds=pass_fds
+        )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await daemon_running(path):
+        if process.returncode is not None or loop.time() > deadline:
+            raise RuntimeError("Worker daemon failed to start")
+        await asyncio.sleep(0.1)
+    return process
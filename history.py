@@ -0,0 +1,127 @@
+import asyncio
+from telethon.tl.functions.messages import GetHistoryRequest
+from rate_limit import HISTORY, limited
+
+# Streaming settings
+HISTORY_LIMIT = 100
+QUEUE_SIZE = 500
+FETCH_BATCH = 20
+
+
+class MessageRef:
+    """What the send path needs to know about a source message before fetching it"""
+    __slots__ = ("id", "grouped_id", "media_type", "file_size")
+
+    def __init__(self, id, grouped_id=None, media_type=None, file_size=None):
+        self.id = id
+        self.grouped_id = grouped_id
+        self.media_type = media_type
+        self.file_size = file_size
+
+    @classmethod
+    def from_message(cls, msg):
+        media = msg.media
+        return cls(
+            msg.id,
+            msg.grouped_id,
+            type(media).__name__ if media else None,
+            msg.file.size if media and msg.file else None,
+        )
+
+
+async def count_history(client, entity, min_id=0, max_id=0, limiter=None):
+    """Get message count in channel, bounded by the optional ID range"""
+    history = await limited(limiter, HISTORY, client, GetHistoryRequest(
+        peer=entity,
+        offset_id=0,
+        offset_date=None,
+        add_offset=0,
+        limit=1,
+        max_id=max_id + 1 if max_id else 0,
+        min_id=min_id - 1 if min_id else 0,
+        hash=0
+    ))
+    total = getattr(history, "count", len(history.messages))
+    if max_id:
+        total = min(total, max_id - max(min_id, 1) + 1)
+    return max(total, 0)
+
+async def iter_history(client, entity, min_id=0, max_id=0, limit=HISTORY_LIMIT, limiter=None):
+    """Walk channel history oldest-first, one page at a time"""
+    # min_id/max_id are inclusive (0 means unbounded) and go to the server,
+    # so a range clone only pages through the requested range. With a
+    # negative add_offset the server returns the page of messages starting
+    # at offset_id and going up, so the cursor only moves forward.
+    offset_id = max(min_id, 1)
+
+    while True:
+        if max_id and offset_id > max_id:
+            break
+
+        history = await limited(limiter, HISTORY, client, GetHistoryRequest(
+            peer=entity,
+            offset_id=offset_id,
+            offset_date=None,
+            add_offset=-limit,
+            limit=limit,
+            max_id=max_id + 1 if max_id else 0,
+            min_id=min_id - 1 if min_id else 0,
+            hash=0
+        ))
+        if not history.messages:
+            break
+
+        for msg in reversed(history.messages):
+            if msg.id < offset_id or (max_id and msg.id > max_id):
+                continue
+            yield msg
+        offset_id = history.messages[0].id + 1
+
+async def stream_history(client, entity, min_id=0, max_id=0, queue_size=QUEUE_SIZE, index=None, limiter=None):
+    """Yield history oldest-first while the next pages are fetched in the background"""
+    queue = asyncio.Queue(maxsize=queue_size)
+    if index:
+        source = index.stream(client, entity, min_id, max_id, limiter)
+    else:
+        source = iter_history(client, entity, min_id, max_id, limiter=limiter)
+
+    async def produce():
+        try:
+            async for msg in source:
+                await queue.put(msg)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+async def chunked(stream, size):
+    """Group an async stream into lists of at most size items"""
+    batch = []
+    async for item in stream:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def fetch_messages(client, entity, refs, batch_size=FETCH_BATCH, limiter=None):
+    """Turn a stream of MessageRefs back into full messages, a small batch at a time"""
+    async for batch in chunked(refs, batch_size):
+        for msg in await limited(limiter, HISTORY, client.get_messages, entity, ids=[ref.id for ref in batch]):
+            if msg:
+                yield msg
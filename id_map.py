@@ -0,0 +1,81 @@
+import sqlite3
+
+MAP_FILE = "id_map.db"
+LOOKUP_BATCH = 500
+MAP_BATCH = 256
+
+
+class IdMap:
+    """Which target message each source message became, for one source/target pair"""
+    # Rows are buffered and written in one transaction per flush(), which the
+    # sent store calls right before each journal group commit; MAP_BATCH
+    # rows force one in between. WAL with synchronous=NORMAL keeps those
+    # transactions to appends without an fsync each.
+
+    def __init__(self, source_id, target_id, path=MAP_FILE):
+        self.source_id = source_id
+        self.target_id = target_id
+        self._pending = {}
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS id_map (
+                source_channel INTEGER NOT NULL,
+                target_channel INTEGER NOT NULL,
+                source_id INTEGER NOT NULL,
+                target_id INTEGER NOT NULL,
+                grouped_id INTEGER,
+                PRIMARY KEY (source_channel, target_channel, source_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS id_map_target
+                ON id_map (target_channel, target_id);
+        """)
+
+    def add(self, pairs):
+        """Record (source_id, target_id, grouped_id) rows, written at the next flush()"""
+        for source_id, target_id, grouped_id in pairs:
+            self._pending[source_id] = (target_id, grouped_id)
+        if len(self._pending) >= MAP_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO id_map VALUES (?, ?, ?, ?, ?)",
+                [(self.source_id, self.target_id, source_id, target_id, grouped_id)
+                 for source_id, (target_id, grouped_id) in self._pending.items()]
+            )
+        self._pending = {}
+
+    def lookup(self, source_ids):
+        """Map many source IDs to target IDs at once; unknown IDs are left out"""
+        found = {source_id: self._pending[source_id][0] for source_id in source_ids if source_id in self._pending}
+        source_ids = [source_id for source_id in source_ids if source_id not in found]
+        for i in range(0, len(source_ids), LOOKUP_BATCH):
+            batch = source_ids[i:i + LOOKUP_BATCH]
+            found.update(self.db.execute(
+                f"SELECT source_id, target_id FROM id_map "
+                f"WHERE source_channel = ? AND target_channel = ? "
+                f"AND source_id IN ({', '.join('?' * len(batch))})",
+                (self.source_id, self.target_id, *batch)
+            ).fetchall())
+        return found
+
+    def get(self, source_id):
+        return self.lookup([source_id]).get(source_id)
+
+    def source_of(self, target_id):
+        """The source message a target message was copied from"""
+        self.flush()
+        row = self.db.execute(
+            "SELECT source_id FROM id_map WHERE target_channel = ? AND target_id = ? AND source_channel = ?",
+            (self.target_id, target_id, self.source_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.flush()
+        self.db.close()
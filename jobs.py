@@ -0,0 +1,56 @@
+import json
+import os
+from datetime import datetime
+
+JOB_FILE = "jobs.json"
+JOB_HISTORY = 50
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+STOPPED = "stopped"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Clone jobs kept on disk, so a restarted daemon picks up where the last one left off"""
+
+    def __init__(self, path=JOB_FILE):
+        self.path = path
+        self.jobs = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.jobs = json.load(f)
+        # A job that was running when the daemon died is simply run again;
+        # the sent store and checkpoints make that a resume
+        for job in self.jobs:
+            if job["status"] == RUNNING:
+                job["status"] = QUEUED
+        self.next_id = max((job["id"] for job in self.jobs), default=0) + 1
+
+    def submit(self, **params):
+        job = {"id": self.next_id, "status": QUEUED, "submitted": datetime.now().isoformat(), **params}
+        self.next_id += 1
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def get(self, job_id):
+        return next((job for job in self.jobs if job["id"] == job_id), None)
+
+    def set_status(self, job, status, **fields):
+        job.update(status=status, **fields)
+        self.save()
+
+    def save(self):
+        # Finished jobs beyond the last JOB_HISTORY are dropped
+        finished = [job for job in self.jobs if job["status"] not in (QUEUED, RUNNING)]
+        drop = {job["id"] for job in finished[:-JOB_HISTORY]}
+        self.jobs = [job for job in self.jobs if job["id"] not in drop]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+
+# Journal settings
+JOURNAL_BATCH = 64
+JOURNAL_INTERVAL = 1.0
+COMPACT_RECORDS = 10000
+
+
+class Journal:
+    """Append-only JSON-lines log, written in groups with one fsync per group"""
+    # Records are buffered and committed once JOURNAL_BATCH of them are
+    # waiting or JOURNAL_INTERVAL seconds after the first one, whichever
+    # comes first. After COMPACT_RECORDS committed records, snapshot() is
+    # asked to save the whole state elsewhere and the journal starts over
+    # with whatever records snapshot() returns. before_commit() runs ahead of
+    # each group, for state that must not be durable later than the records.
+
+    def __init__(self, path, snapshot=None, on_commit=None, batch=JOURNAL_BATCH,
+                 interval=JOURNAL_INTERVAL, compact_records=COMPACT_RECORDS, before_commit=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.on_commit = on_commit
+        self.before_commit = before_commit
+        self.batch = batch
+        self.interval = interval
+        self.compact_records = compact_records
+        self._pending = []
+        self._timer = None
+        records, length = self._scan()
+        self._records = len(records)
+        # Cut a line torn by a crash mid-write, or new records would be
+        # appended onto it and be lost with it on the next replay
+        if os.path.exists(path) and os.path.getsize(path) > length:
+            os.truncate(path, length)
+        self._file = open(path, "a")
+
+    def _scan(self):
+        """Committed records and the byte length of the file they fill"""
+        if not os.path.exists(self.path):
+            return [], 0
+        records = []
+        length = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # Only the last line can be torn, by a crash mid-write
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                length += len(line)
+        return records, length
+
+    def replay(self):
+        """Every committed record, oldest first"""
+        return self._scan()[0]
+
+    def append(self, record):
+        self._pending.append(json.dumps(record))
+        if len(self._pending) >= self.batch:
+            self.commit()
+        elif self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.interval, self.commit)
+            except RuntimeError:
+                self.commit()
+
+    def commit(self):
+        """Write and fsync everything buffered"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        if self.before_commit:
+            self.before_commit()
+        self._file.write("\n".join(self._pending) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records += len(self._pending)
+        self._pending = []
+        if self.on_commit:
+            self.on_commit()
+        if self.snapshot and self._records >= self.compact_records:
+            self.compact()
+
+    def compact(self):
+        """Save a snapshot, then empty the journal"""
+        # A crash between the two only means replaying records the
+        # snapshot already holds, so records must be safe to apply twice
+        self.commit()
+        seed = list(self.snapshot() or [])
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in seed)
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a")
+        self._records = len(seed)
+
+    def close(self):
+        self.commit()
+        self._file.close()
@@ -15,23 +15,20 @@ from telegram.ext import (
     filters,
 )
 from clone_worker import clone_worker  # <- Import clone logic
+from config_store import config_store
+from control import request_stop
 
 # Load token
 with open("bot.json") as f:
     bot_data = json.load(f)
 BOT_TOKEN = bot_data["bot_token"]
-CONFIG_FILE = "config.json"
 
 # Flags
 is_cloning = False
 
 # Save channel ID
 def save_channel_id(key, chat_id):
-    with open(CONFIG_FILE) as f:
-        config = json.load(f)
-    config[key] = chat_id
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
+    config_store.set(key, chat_id)
 
 # Show Start Mission Menu
 async def show_start_mission_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -88,8 +85,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("✏️ Send range like:\n`start_id end_id`\nExample: `100 200`", parse_mode="Markdown")
 
     elif text == "⛔ Stop Clone":
-        with open("stop.flag", "w") as f:
-            f.write("stop")
+        await request_stop()
         await update.message.reply_text("🛑 Clone stop requested.")
 
     elif " " in text and all(x.isdigit() for x in text.split()) and len(text.split()) == 2:
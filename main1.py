@@ -15,17 +15,13 @@ from telegram.ext import (
     filters,
 )
 from clone_worker import clone_worker
+from config_store import config_store
 
-CONFIG_FILE = "config.json"
 BOT_TOKEN = json.load(open("bot.json"))["bot_token"]
 
 # Helpers
 def save_channel_id(key, chat_id):
-    with open(CONFIG_FILE) as f:
-        config = json.load(f)
-    config[key] = chat_id
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
+    config_store.set(key, chat_id)
 
 # /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -16,10 +16,11 @@ from telegram.ext import (
     ConversationHandler,
 )
 from clone_worker import (clone_worker, live_updates)
+from config_store import config_store
+from control import request_stop
 from telethon.sync import TelegramClient
 from telegram.constants import ParseMode
 
-CONFIG_FILE = "config.json"
 BOT_FILE = "bot.json"
 STOP_FLAG = "stop.flag"
 SESSION_FILE = "anon.session"
@@ -34,19 +35,13 @@ with open(BOT_FILE) as f:
 # ---------------------- UTILS ----------------------
 
 def load_config():
-    if not os.path.exists(CONFIG_FILE):
-        return {}
-    with open(CONFIG_FILE) as f:
-        return json.load(f)
+    return config_store.load()
 
 def save_config(data):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    config_store.save(data)
 
 def ensure_config_key(key, value):
-    config = load_config()
-    config[key] = value
-    save_config(config)
+    config_store.set(key, value)
 
 
 
@@ -423,8 +418,10 @@ async def stop_clone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if os.path.exists(START_FLAG):
         os.remove(START_FLAG)
 
+    # The flag also marks the clone as resumable
     with open(STOP_FLAG, "w") as f:
         f.write("stop")
+    await request_stop()
     await update.message.reply_text("⛔ Clone stopped.", reply_markup=mission_menu())
     return MISSION
     
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import math
+import os
+from telethon import helpers, utils
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import GetFileRequest, SaveBigFilePartRequest
+from telethon.tl.types import InputFileBig
+from telethon.tl.types.upload import File
+
+# Parallel transfer settings
+CONNECTIONS = 4
+PART_SIZE = 512 * 1024
+MIN_PART_SIZE = 4 * 1024
+MAX_PART_SIZE = 1024 * 1024
+PARALLEL_MIN_SIZE = 10 * 1024 * 1024
+PARTS_PER_CONNECTION = 8
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_EVERY = 16
+
+
+class CdnRedirect(Exception):
+    """The file is served from a CDN, which needs Telethon's own downloader"""
+
+
+def download_part_size(size):
+    """The largest part size GetFileRequest accepts that is no bigger than `size`"""
+    # The limit must divide 1 MB and be a multiple of 4 KB, and a part may
+    # not cross a 1 MB boundary: together, a power of two from 4 KB to 1 MB
+    size = max(MIN_PART_SIZE, min(MAX_PART_SIZE, int(size)))
+    return 1 << (size.bit_length() - 1)
+
+
+class Checkpoint:
+    """Persisted part progress of one large file, so a restart resumes instead of starting over"""
+
+    def __init__(self, key, directory=CHECKPOINT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{key}.json")
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.part_size = data.get("part_size")
+        self.downloaded = set(data.get("downloaded", []))
+        self.upload_file_id = data.get("upload_file_id")
+        self.upload_owner = data.get("upload_owner")
+        self.upload_part_size = data.get("upload_part_size")
+        self.uploaded = set(data.get("uploaded", []))
+        self._unsaved = 0
+
+    def mark(self, parts, part):
+        parts.add(part)
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "part_size": self.part_size,
+                "downloaded": sorted(self.downloaded),
+                "upload_file_id": self.upload_file_id,
+                "upload_owner": self.upload_owner,
+                "upload_part_size": self.upload_part_size,
+                "uploaded": sorted(self.uploaded)
+            }, f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def reset_upload(self):
+        """Forget an upload whose parts the server no longer has"""
+        self.upload_file_id = None
+        self.upload_owner = None
+        self.upload_part_size = None
+        self.uploaded = set()
+        self.save()
+
+    @staticmethod
+    def discard(key, directory=CHECKPOINT_DIR):
+        """Forget a file's progress once it has been sent"""
+        path = os.path.join(directory, f"{key}.json")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SenderPool:
+    """Extra MTProto connections to one DC, used for parallel file parts"""
+
+    def __init__(self, client, dc_id):
+        self.client = client
+        self.dc_id = dc_id
+        self.senders = []
+        self._auth_key = client.session.auth_key if dc_id == client.session.dc_id else None
+
+    async def _connect_one(self):
+        client = self.client
+        dc = await client._get_dc(self.dc_id)
+        sender = MTProtoSender(self._auth_key, loggers=client._log)
+        await sender.connect(client._connection(
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=client._log,
+            proxy=client._proxy,
+            local_addr=client._local_addr
+        ))
+        if not self._auth_key:
+            # Foreign DC: authorize the first connection, later ones reuse its key
+            auth = await client(ExportAuthorizationRequest(self.dc_id))
+            client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+            await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+            self._auth_key = sender.auth_key
+        return sender
+
+    async def connect(self, count):
+        self.senders.append(await self._connect_one())
+        self.senders.extend(await asyncio.gather(*(self._connect_one() for _ in range(count - 1))))
+        return self
+
+    async def close(self):
+        for sender in self.senders:
+            await sender.disconnect()
+        self.senders = []
+
+async def download_parallel(client, msg, path, connections=CONNECTIONS, part_size=PART_SIZE, checkpoint=None):
+    """Download a document's parts concurrently, writing each at its offset in a preallocated file"""
+    dc_id, location = utils.get_input_location(msg.media)
+    size = msg.file.size
+    part_size = download_part_size(part_size)
+    parts = math.ceil(size / part_size)
+
+    # Parts already on disk from an earlier run are kept if nothing changed
+    resume = (checkpoint is not None and checkpoint.part_size == part_size
+              and os.path.exists(path) and os.path.getsize(path) == size)
+    if checkpoint is not None and not resume:
+        checkpoint.part_size = part_size
+        checkpoint.downloaded = set()
+    done_parts = checkpoint.downloaded if resume else set()
+    next_part = iter([part for part in range(parts) if part not in done_parts])
+
+    pool = await SenderPool(client, dc_id or client.session.dc_id).connect(
+        max(1, min(connections, parts - len(done_parts))))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    done = False
+    try:
+        os.ftruncate(fd, size)
+
+        async def fetch(sender):
+            for part in next_part:
+                result = await sender.send(GetFileRequest(location, offset=part * part_size, limit=part_size))
+                if not isinstance(result, File):
+                    raise CdnRedirect(f"Got {type(result).__name__} for part {part}")
+                os.pwrite(fd, result.bytes, part * part_size)
+                if checkpoint is not None:
+                    checkpoint.mark(checkpoint.downloaded, part)
+
+        await asyncio.gather(*(fetch(sender) for sender in pool.senders))
+        done = True
+    finally:
+        os.close(fd)
+        await pool.close()
+        if checkpoint is not None:
+            checkpoint.save()
+        elif not done:
+            os.remove(path)
+    return path
+
+async def upload_parallel(client, path, connections=CONNECTIONS, checkpoint=None):
+    """Upload a big file's parts concurrently, returning the InputFileBig to send"""
+    size = os.path.getsize(path)
+    # Telegram's recommended part size grows with the file; small files
+    # don't get more connections than they have work for
+    part_size = utils.get_appropriated_part_size(size) * 1024
+    parts = math.ceil(size / part_size)
+
+    # Parts of an interrupted upload stay on the server under its file_id,
+    # but only for the account that uploaded them
+    owner = (await client.get_me(input_peer=True)).user_id
+    if (checkpoint is not None and checkpoint.upload_file_id and checkpoint.upload_part_size == part_size
+            and checkpoint.upload_owner == owner):
+        file_id = checkpoint.upload_file_id
+        done_parts = checkpoint.uploaded
+    else:
+        file_id = helpers.generate_random_long()
+        done_parts = set()
+        if checkpoint is not None:
+            checkpoint.upload_file_id = file_id
+            checkpoint.upload_owner = owner
+            checkpoint.upload_part_size = part_size
+            checkpoint.uploaded = done_parts
+            checkpoint.save()
+    todo = [part for part in range(parts) if part not in done_parts]
+    if not todo:
+        return InputFileBig(file_id, parts, os.path.basename(path))
+    connections = max(1, min(connections, len(todo) // PARTS_PER_CONNECTION))
+    next_part = iter(todo)
+
+    pool = await SenderPool(client, client.session.dc_id).connect(connections)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        async def push(sender):
+            for part in next_part:
+                data = os.pread(fd, part_size, part * part_size)
+                if not await sender.send(SaveBigFilePartRequest(file_id, part, parts, data)):
+                    raise ValueError(f"Part {part} of {path} was not saved")
+                if checkpoint is not None:
+                    checkpoint.mark(checkpoint.uploaded, part)
+
+        await asyncio.gather(*(push(sender) for sender in pool.senders))
+    finally:
+        os.close(fd)
+        await pool.close()
+        if checkpoint is not None:
+            checkpoint.save()
+    return InputFileBig(file_id, parts, os.path.basename(path))
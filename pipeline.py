@@ -0,0 +1,315 @@
+import asyncio
+from control import RunControl
+from parallel_transfer import CONNECTIONS, PART_SIZE, Checkpoint
+from rate_limit import DOWNLOAD, SEND, UPLOAD, limited
+from retry import MAX_ATTEMPTS, REFRESH, REUPLOAD, RetryScheduler
+from sessions import Account, SessionPool
+from spool import Spool
+from transfer import REFERENCE_MODE, copy_album, copy_message, download, needs_upload, upload
+
+# Stage settings
+DOWNLOAD_WORKERS = 3
+UPLOAD_WORKERS = 3
+STAGE_QUEUE = 8
+REORDER_WINDOW = 16
+ALBUM_LIMIT = 10
+# Stages whose worker count can change while running; sends stay one at a time, in order
+STAGE_KINDS = (DOWNLOAD, UPLOAD)
+
+
+class Transfer:
+    """One source message, or all members of an album, moving through the pipeline"""
+    __slots__ = ("seq", "msgs", "data", "files", "error", "account")
+
+    def __init__(self, seq, msgs):
+        self.seq = seq
+        self.msgs = msgs
+        self.data = [None] * len(msgs)
+        self.files = [None] * len(msgs)
+        self.error = None
+        self.account = None
+
+class ClonePipeline:
+    """fetch → download → upload → commit, joined by bounded queues"""
+    # Downloads and uploads may finish out of order; the commit stage holds
+    # them in a reorder buffer and posts strictly in source order. The feeder
+    # never runs more than `window` messages ahead of the last commit.
+    # With a pool of accounts, downloads stay on the first one while uploads
+    # and sends go to whichever account can call soonest; sends are still
+    # made one at a time in order, each waiting only on its own account.
+    # control.resize() changes how many download or upload workers run: new
+    # ones start at once, surplus ones leave after the item in hand.
+
+    def __init__(self, client, source, target, mode=REFERENCE_MODE,
+                 downloads=DOWNLOAD_WORKERS, uploads=UPLOAD_WORKERS, queue_size=STAGE_QUEUE,
+                 window=REORDER_WINDOW, connections=CONNECTIONS, part_size=PART_SIZE,
+                 upload_connections=CONNECTIONS, spool=None, limiter=None, attempts=MAX_ATTEMPTS,
+                 accounts=None, id_map=None, control=None):
+        self.client = client
+        self.source = source
+        self.target = target
+        self.mode = mode
+        self.workers = {DOWNLOAD: downloads, UPLOAD: uploads}
+        self.queue_size = queue_size
+        self.window = asyncio.Semaphore(window)
+        self.connections = connections
+        self.part_size = part_size
+        self.upload_connections = upload_connections
+        self.spool = spool or Spool()
+        # The limiter's buckets also cap how many workers of a stage are busy at once
+        self.limiter = limiter
+        self.accounts = accounts or SessionPool([Account(client, source, target, limiter, primary=True)])
+        # Commits run in source order, so a reply's parent is already mapped when it is sent
+        self.id_map = id_map
+        # Failed items are retried off to the side, so they land after later messages
+        self.retries = RetryScheduler(self._retry, self._give_up, client, attempts)
+        # Every stage waits on the control before starting new work, so a
+        # pause takes effect at once and a stop cancels what is in flight
+        self.control = control or RunControl()
+        self.control.on_stop(self.stop)
+        self.control.on_resize(self.resize)
+        self.stopped = False
+        self._tasks = []
+        self._stages = {DOWNLOAD: [], UPLOAD: []}
+        self._queues = {}
+        self._closing = set()
+        # Downloads not yet uploaded, by id: spool paths and in-memory bytes
+        self._held = {}
+
+    async def on_commit(self, msg):
+        """Called after each message is posted to the target"""
+
+    async def on_error(self, msg, error):
+        """Called when a message could not be copied and will not be retried"""
+
+    async def _feed(self, messages, outbox):
+        # Consecutive messages sharing a grouped_id travel as one album
+        seq = 0
+        group = []
+        async for msg in messages:
+            await self.control.wait()
+            if group and (not msg.grouped_id or msg.grouped_id != group[0].grouped_id
+                          or len(group) >= ALBUM_LIMIT):
+                await self.window.acquire()
+                await outbox.put(Transfer(seq, group))
+                seq += 1
+                group = []
+            group.append(msg)
+        if group:
+            await self.window.acquire()
+            await outbox.put(Transfer(seq, group))
+
+    def _live(self, kind):
+        return sum(not task.done() for task in self._stages[kind])
+
+    def _spawn(self, kind):
+        worker = self._download if kind == DOWNLOAD else self._upload
+        task = asyncio.create_task(worker(*self._queues[kind]))
+        self._stages[kind].append(task)
+        self._tasks.append(task)
+
+    def resize(self, kind, count):
+        """Run `count` workers in a stage from now on"""
+        self.workers[kind] = max(1, int(count))
+        # Once a stage has been told to finish, new workers would never hear of it
+        if kind in self._queues and kind not in self._closing:
+            for _ in range(self.workers[kind] - self._live(kind)):
+                self._spawn(kind)
+
+    async def _download(self, inbox, outbox):
+        while self._live(DOWNLOAD) <= self.workers[DOWNLOAD]:
+            item = await inbox.get()
+            if item is None:
+                break
+            for i, msg in enumerate(item.msgs):
+                if item.error or not needs_upload(self.source, msg, self.mode):
+                    continue
+                await self.control.wait()
+                try:
+                    # Small media stays in memory as bytes, the rest is a spool path
+                    item.data[i] = await limited(self.limiter, DOWNLOAD, download, self.client, msg, self.spool,
+                                                 self.connections, self.part_size)
+                    self._held[id(item.data[i])] = item.data[i]
+                except Exception as e:
+                    item.error = e
+            await outbox.put(item)
+
+    async def _upload(self, inbox, outbox):
+        while self._live(UPLOAD) <= self.workers[UPLOAD]:
+            item = await inbox.get()
+            if item is None:
+                break
+            if any(data is not None for data in item.data):
+                # An uploaded file belongs to the session that uploaded it, so that account also sends
+                item.account = item.account or self.accounts.pick(UPLOAD)
+                await self.control.wait()
+                async with item.account.busy():
+                    await self._upload_files(item)
+            await outbox.put(item)
+
+    async def _upload_files(self, item):
+        account = item.account
+        for i, data in enumerate(item.data):
+            if data is None:
+                continue
+            try:
+                if not item.error:
+                    item.files[i] = await limited(account.limiter, UPLOAD, upload, account.client, item.msgs[i],
+                                                  data, self.upload_connections)
+            except Exception as e:
+                item.error = e
+            finally:
+                # A file that didn't make it stays around for the next run to resume
+                await self._discard(data, keep=item.files[i] is None)
+                item.data[i] = None
+
+    async def _commit(self, inbox):
+        pending = {}
+        next_seq = 0
+        while True:
+            item = await inbox.get()
+            if item is None:
+                break
+            pending[item.seq] = item
+            while next_seq in pending:
+                await self.control.wait()
+                await self._send(pending.pop(next_seq))
+                next_seq += 1
+                self.window.release()
+
+    async def _deliver(self, item):
+        if item.error:
+            raise item.error
+        account = item.account or self.accounts.pick(SEND)
+        msgs = await account.localize(item.msgs, item.files)
+        reply_to = self._reply_to(msgs)
+        if len(msgs) == 1:
+            return await limited(account.limiter, SEND, copy_message, account.client, account.source,
+                                 account.target, msgs[0], self.mode, item.files[0], self.spool, reply_to)
+        return await limited(account.limiter, SEND, copy_album, account.client, account.source,
+                             account.target, msgs, item.files, self.spool, reply_to)
+
+    def _reply_to(self, msgs):
+        """The target ID of the message the source message replied to, if it was cloned"""
+        parent = next((msg.reply_to_msg_id for msg in msgs if msg.reply_to_msg_id), None)
+        if not parent or not self.id_map:
+            return None
+        return self.id_map.get(parent)
+
+    async def _committed(self, item, sent):
+        if self.id_map and sent:
+            sent = sent if isinstance(sent, list) else [sent]
+            self.id_map.add((msg.id, copied.id, msg.grouped_id) for msg, copied in zip(item.msgs, sent) if copied)
+        for msg in item.msgs:
+            if msg.document:
+                Checkpoint.discard(msg.document.id)
+            await self.on_commit(msg)
+
+    async def _send(self, item):
+        try:
+            sent = await self._deliver(item)
+        except Exception as e:
+            await self.retries.failed(item, e)
+            return
+        await self._committed(item, sent)
+
+    async def _retry(self, item, kind):
+        """Run one item through download, upload and send again"""
+        await self.control.wait()
+        if kind == REFRESH:
+            # Expired file references come back fresh with a re-fetched message
+            fresh = await self.client.get_messages(self.source, ids=[msg.id for msg in item.msgs])
+            item.msgs = [new or old for new, old in zip(fresh, item.msgs)]
+        elif kind == REUPLOAD:
+            # The server lost the uploaded parts; send_uploaded already reset the checkpoints
+            item.files = [None] * len(item.msgs)
+        item.error = None
+        if not any(item.files):
+            # Nothing is tied to an account yet, so the retry may go through any of them
+            item.account = None
+        for i, msg in enumerate(item.msgs):
+            if item.files[i] is not None or not needs_upload(self.source, msg, self.mode):
+                continue
+            data = await limited(self.limiter, DOWNLOAD, download, self.client, msg, self.spool,
+                                 self.connections, self.part_size)
+            account = item.account = item.account or self.accounts.pick(UPLOAD)
+            try:
+                item.files[i] = await limited(account.limiter, UPLOAD, upload, account.client, msg, data,
+                                              self.upload_connections)
+            finally:
+                if item.files[i] is None:
+                    await self.spool.abandon(data)
+                else:
+                    await self.spool.release(data)
+        await self._committed(item, await self._deliver(item))
+
+    async def _give_up(self, item, error):
+        for msg in item.msgs:
+            await self.on_error(msg, error)
+
+    async def _discard(self, data, keep=False):
+        self._held.pop(id(data), None)
+        if keep:
+            await self.spool.abandon(data)
+        else:
+            await self.spool.release(data)
+
+    async def _wait(self, stage):
+        """Wait for a stage's tasks, raising as soon as a task of any stage fails"""
+        # A dead stage would otherwise leave the ones before it blocked on a
+        # full queue or the reorder window for good
+        while True:
+            for task in self._tasks:
+                if task.done():
+                    if task.cancelled():
+                        raise asyncio.CancelledError()
+                    if task.exception():
+                        raise task.exception()
+            if all(task.done() for task in stage):
+                return
+            await asyncio.wait([task for task in self._tasks if not task.done()],
+                               return_when=asyncio.FIRST_COMPLETED)
+
+    async def run(self, messages):
+        """Clone a stream of full messages; returns when it is exhausted or stop() is called"""
+        download_q = asyncio.Queue(self.queue_size)
+        upload_q = asyncio.Queue(self.queue_size)
+        commit_q = asyncio.Queue(self.queue_size)
+
+        feeders = [asyncio.create_task(self._feed(messages, download_q))]
+        committer = asyncio.create_task(self._commit(commit_q))
+        self._tasks = feeders + [committer]
+        self._queues = {DOWNLOAD: (download_q, upload_q), UPLOAD: (upload_q, commit_q)}
+        for kind in STAGE_KINDS:
+            for _ in range(self.workers[kind]):
+                self._spawn(kind)
+
+        try:
+            # Each stage is told to finish once every task of the stage before
+            # it is done, with one None for each of its workers still running
+            for stage, queue, kind in ((feeders, download_q, DOWNLOAD),
+                                       (self._stages[DOWNLOAD], upload_q, UPLOAD),
+                                       (self._stages[UPLOAD], commit_q, None)):
+                await self._wait(stage)
+                if kind:
+                    self._closing.add(kind)
+                for _ in range(self._live(kind) if kind else 1):
+                    await queue.put(None)
+            await self._wait([committer])
+            await self.retries.drain()
+        except asyncio.CancelledError:
+            if not self.stopped:
+                raise
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            self.retries.cancel()
+            for data in list(self._held.values()):
+                await self._discard(data, keep=True)
+
+    def stop(self):
+        """Cancel everything in flight"""
+        self.stopped = True
+        for task in self._tasks:
+            task.cancel()
+        self.retries.cancel()
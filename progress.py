@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+
+# Progress stream settings
+PROGRESS_INTERVAL = 0.5
+IDLE = {"status": "inactive", "progress": 0, "total": 0, "current": "", "chat_id": None}
+
+
+class ProgressWriter:
+    """Worker side: JSON-lines progress events on a dedicated file descriptor"""
+    # Progress ticks are thinned to one per PROGRESS_INTERVAL; status changes
+    # always go out. Without a descriptor every call is a no-op.
+
+    def __init__(self, fd=None, interval=PROGRESS_INTERVAL, fields=None):
+        self.file = os.fdopen(fd, "w", buffering=1) if fd is not None else None
+        self.interval = interval
+        self.fields = fields or {}
+        self.last_tick = 0
+
+    def for_job(self, job_id):
+        """A writer on the same stream whose events are tagged with the job"""
+        writer = ProgressWriter(interval=self.interval, fields={"job": job_id})
+        writer.file = self.file
+        return writer
+
+    def emit(self, event, **fields):
+        if not self.file:
+            return
+        try:
+            self.file.write(json.dumps({
+                "event": event, "timestamp": datetime.now().isoformat(), **self.fields, **fields
+            }) + "\n")
+        except (BrokenPipeError, OSError):
+            # The bot went away; the clone carries on without it
+            self.file = None
+
+    def status(self, status, **fields):
+        self.emit("status", status=status, **fields)
+
+    def tick(self, progress, total, current=""):
+        now = time.monotonic()
+        if now - self.last_tick >= self.interval:
+            self.last_tick = now
+            self.emit("progress", progress=progress, total=total, current=current)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class ProgressReader:
+    """Bot side: follows a worker's event stream into in-memory snapshots"""
+    # Events tagged with a job update that job's entry in `jobs`; `snapshot`
+    # is the stream as a whole in the shape get_progress() returns, summed
+    # over the active jobs while there are any.
+
+    def __init__(self):
+        self.snapshot = dict(IDLE)
+        self.jobs = {}
+        self.task = None
+
+    def follow(self, fd):
+        """Start reading a new worker's stream, replacing any previous one"""
+        if self.task:
+            self.task.cancel()
+        self.snapshot = dict(IDLE)
+        self.jobs = {}
+        self.task = asyncio.create_task(self._read(fd))
+
+    def active(self):
+        return [job for job in self.jobs.values() if job["status"] == "active"]
+
+    def _aggregate(self):
+        active = self.active()
+        if active:
+            self.snapshot.update(
+                status="active",
+                progress=sum(job["progress"] for job in active),
+                total=sum(job["total"] for job in active),
+                current="; ".join(f"Job {job['job']}: {job['current']}" for job in active)
+            )
+
+    async def _read(self, fd):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb")
+        )
+        try:
+            async for line in reader:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                event.pop("event", None)
+                self.snapshot.update(event)
+                if "job" in event:
+                    self.jobs.setdefault(event["job"], dict(IDLE)).update(event)
+                    self._aggregate()
+        finally:
+            transport.close()
+        # End of stream means the worker exited, whether or not it said goodbye
+        for snapshot in [self.snapshot, *self.jobs.values()]:
+            if snapshot["status"] == "active":
+                snapshot["status"] = "inactive"
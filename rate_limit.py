@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import time
+from telethon.errors import FloodWaitError
+
+# Method classes
+SEND = "send"
+UPLOAD = "upload"
+DOWNLOAD = "download"
+HISTORY = "history"
+EDIT = "edit"
+
+# Starting requests per second; each class then finds its own limit
+DEFAULT_RATES = {
+    SEND: 1.0,
+    UPLOAD: 2.0,
+    DOWNLOAD: 2.0,
+    HISTORY: 3.0,
+    EDIT: 1.0,
+}
+MIN_RATE = 0.05
+MAX_RATE = 20.0
+RATE_STEP = 0.1
+BACKOFF = 0.5
+PROBE_AFTER = 20
+CONCURRENCY = 8
+FLOOD_RETRIES = 5
+
+# Job priorities, as shares of an account's budget
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITY_WEIGHTS = {
+    INTERACTIVE: 8,
+    BACKGROUND: 1,
+}
+
+
+class TokenBucket:
+    """Token bucket whose rate and in-flight cap adapt to FloodWait feedback"""
+    # Additive increase, multiplicative decrease: after PROBE_AFTER calls in
+    # a row without a flood the rate creeps up by RATE_STEP and one more call
+    # may run at once; a flood halves both and blocks the bucket for the
+    # time the server asked for. Throughput settles just under the real limit.
+
+    def __init__(self, rate, concurrency=CONCURRENCY, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = concurrency
+        self.max_concurrency = concurrency
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self.calm = 0
+        self._lock = asyncio.Lock()
+        self._slots = asyncio.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait for a free slot and a token"""
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.blocked_until:
+                        await asyncio.sleep(self.blocked_until - now)
+                        continue
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        except BaseException:
+            await self.release()
+            raise
+
+    def delay(self):
+        """Seconds until a call could start, as far as the bucket knows now"""
+        now = time.monotonic()
+        tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        return max(self.blocked_until - now, (1 - tokens) / self.rate, 0.0)
+
+    async def release(self):
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+    async def configure(self, rate=None, concurrency=None):
+        """Set the rate and/or in-flight cap by hand; AIMD carries on from there"""
+        if rate:
+            self.rate = self.max_rate = max(self.min_rate, rate)
+        if concurrency:
+            self.concurrency = self.max_concurrency = max(1, concurrency)
+            async with self._slots:
+                self._slots.notify_all()
+
+    def success(self):
+        self.calm += 1
+        if self.calm >= PROBE_AFTER:
+            self.calm = 0
+            self.rate = min(self.max_rate, self.rate + RATE_STEP)
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    def flood(self, seconds):
+        self.calm = 0
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.rate = max(self.min_rate, self.rate * BACKOFF)
+        self.concurrency = max(1, self.concurrency * BACKOFF)
+
+
+class RateLimiter:
+    """One adaptive bucket per method class, shared by everything using a session"""
+
+    def __init__(self, rates=None, concurrency=CONCURRENCY):
+        rates = {**DEFAULT_RATES, **(rates or {})}
+        self.buckets = {kind: TokenBucket(rate, concurrency) for kind, rate in rates.items()}
+
+    async def configure(self, kind, rate=None, concurrency=None):
+        await self.buckets[kind].configure(rate, concurrency)
+
+    async def acquire(self, kind):
+        await self.buckets[kind].acquire()
+
+    async def call(self, kind, func, *args, retries=FLOOD_RETRIES, **kwargs):
+        """Run func under the kind's bucket, waiting out and retrying FloodWaits"""
+        bucket = self.buckets[kind]
+        for attempt in range(retries + 1):
+            await self.acquire(kind)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                bucket.flood(e.seconds)
+                if attempt >= retries:
+                    raise
+                continue
+            finally:
+                await bucket.release()
+            bucket.success()
+            return result
+
+
+class FairShare:
+    """Weighted-fair order in which several jobs draw on one limiter's buckets"""
+    # Start-time fair queuing: each call is tagged with the job's virtual
+    # time plus 1/weight and calls enter the bucket one at a time, lowest tag
+    # first. A job gets tokens in proportion to its weight while it is busy,
+    # an idle job banks no credit, and every waiting job moves forward.
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._waiting = {kind: [] for kind in limiter.buckets}
+        self._clock = dict.fromkeys(limiter.buckets, 0.0)
+        self._busy = dict.fromkeys(limiter.buckets, False)
+        self._order = itertools.count()
+
+    def job(self, priority=BACKGROUND):
+        return JobLimiter(self, PRIORITY_WEIGHTS.get(priority, 1))
+
+    async def acquire(self, kind, job):
+        tag = max(self._clock[kind], job.finish[kind]) + 1 / job.weight
+        job.finish[kind] = tag
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting[kind], (tag, next(self._order), turn))
+        self._dispatch(kind)
+        try:
+            await turn
+            await self.limiter.acquire(kind)
+        finally:
+            # A turn cancelled while queued was never granted; any other one
+            # passes on to the next caller
+            if not turn.cancelled():
+                self._busy[kind] = False
+                self._dispatch(kind)
+
+    def _dispatch(self, kind):
+        waiting = self._waiting[kind]
+        while not self._busy[kind] and waiting:
+            tag, _, turn = heapq.heappop(waiting)
+            if turn.cancelled():
+                continue
+            self._busy[kind] = True
+            self._clock[kind] = tag
+            turn.set_result(None)
+
+
+class JobLimiter(RateLimiter):
+    """One job's view of a shared limiter: same buckets, fair-queued entry"""
+
+    def __init__(self, share, weight=1):
+        self.share = share
+        self.buckets = share.limiter.buckets
+        self.weight = weight
+        self.finish = dict.fromkeys(self.buckets, 0.0)
+
+    async def acquire(self, kind):
+        await self.share.acquire(kind, self)
+
+
+async def limited(limiter, kind, func, *args, **kwargs):
+    """Call through the limiter when there is one"""
+    if limiter is None:
+        return await func(*args, **kwargs)
+    return await limiter.call(kind, func, *args, **kwargs)
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import random
+import socket
+from datetime import datetime
+from telethon.errors import FloodWaitError, ServerError, SlowModeWaitError, TimedOutError
+from transfer import REFERENCE_ERRORS, UPLOAD_ERRORS
+
+# Error classes
+RETRY_AFTER = "retry_after"
+REFRESH = "refresh"
+REUPLOAD = "reupload"
+RECONNECT = "reconnect"
+PERMANENT = "permanent"
+
+# Retry settings
+MAX_ATTEMPTS = 5
+BASE_DELAY = 2
+MAX_DELAY = 300
+DEAD_LETTER_FILE = "dead_letters.jsonl"
+
+
+def classify(error):
+    """Which retry policy an error falls under"""
+    if isinstance(error, (FloodWaitError, SlowModeWaitError)):
+        return RETRY_AFTER
+    if isinstance(error, REFERENCE_ERRORS):
+        return REFRESH
+    if isinstance(error, UPLOAD_ERRORS):
+        return REUPLOAD
+    # Network trouble only; other OSErrors (a full disk, a missing file) won't clear up on a reconnect
+    if isinstance(error, (ServerError, TimedOutError, ConnectionError, socket.timeout, socket.gaierror,
+                          asyncio.TimeoutError)):
+        return RECONNECT
+    return PERMANENT
+
+def retry_delay(error, kind, attempt):
+    """Seconds to wait before the next attempt"""
+    if kind == RETRY_AFTER:
+        return error.seconds + random.uniform(0, 1)
+    # Exponential backoff with jitter, so retries don't arrive in bursts
+    return min(MAX_DELAY, BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+class DeadLetters:
+    """Persisted list of messages that failed for good, kept for a later replay"""
+    # Entries are kept per (source, target) pair: a message that failed
+    # going to one target says nothing about another target
+
+    def __init__(self, path=DEAD_LETTER_FILE):
+        self.path = path
+
+    def add(self, source_id, target_id, msg_id, error):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({
+                "source": source_id,
+                "target": target_id,
+                "id": msg_id,
+                "error": f"{type(error).__name__}: {error}",
+                "time": datetime.now().isoformat(timespec="seconds")
+            }) + "\n")
+
+    def _entries(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _matches(self, entry, source_id, target_id):
+        return entry["source"] == source_id and entry.get("target") == target_id
+
+    def ids(self, source_id, target_id):
+        return sorted({entry["id"] for entry in self._entries() if self._matches(entry, source_id, target_id)})
+
+    def remove(self, source_id, target_id, ids):
+        """Drop entries whose messages have been cloned since"""
+        ids = set(ids)
+        kept = [entry for entry in self._entries()
+                if not self._matches(entry, source_id, target_id) or entry["id"] not in ids]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in kept)
+        os.replace(tmp_path, self.path)
+
+
+class RetryScheduler:
+    """Re-runs failed items in the background after a per-error-class delay"""
+    # run(item, kind) is awaited again for each retry, with kind telling it
+    # whether to refresh file references or upload its files again first;
+    # give_up(item, error) gets permanent failures and items out of attempts.
+    # The caller's main stream never waits on a retry.
+
+    def __init__(self, run, give_up, client=None, attempts=MAX_ATTEMPTS):
+        self.run = run
+        self.give_up = give_up
+        self.client = client
+        self.attempts = attempts
+        self._tasks = set()
+
+    async def failed(self, item, error, attempt=0):
+        kind = classify(error)
+        if kind == PERMANENT or attempt >= self.attempts:
+            await self.give_up(item, error)
+            return
+        task = asyncio.create_task(self._retry(item, kind, retry_delay(error, kind, attempt), attempt + 1))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _retry(self, item, kind, delay, attempt):
+        await asyncio.sleep(delay)
+        try:
+            if kind == RECONNECT and self.client and not self.client.is_connected():
+                await self.client.connect()
+            await self.run(item, kind)
+        except Exception as e:
+            await self.failed(item, e, attempt)
+
+    async def drain(self):
+        """Wait until every scheduled retry has succeeded or given up"""
+        while self._tasks:
+            # A retry only fails when giving up did, which must not go unnoticed
+            results = await asyncio.gather(*list(self._tasks), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
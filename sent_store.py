@@ -0,0 +1,143 @@
+import bisect
+import json
+import os
+from array import array
+from journal import Journal
+
+# Sent-ID store settings
+SENT_DIR = "sent"
+LEGACY_LOG = "sent_ids.txt"
+RECORD_SIZE = 16
+
+
+class IdRuns:
+    """Set of message IDs kept as sorted, non-overlapping [start, end] runs"""
+    # A channel cloned in order collapses to a handful of runs, so millions
+    # of IDs cost a few bytes instead of ~70 each in a Python set
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def __contains__(self, msg_id):
+        i = bisect.bisect_right(self.starts, msg_id) - 1
+        return i >= 0 and msg_id <= self.ends[i]
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.runs())
+
+    def add_range(self, start, end):
+        # Runs i..j-1 overlap or touch [start, end] and merge into one
+        i = bisect.bisect_left(self.ends, start - 1)
+        j = bisect.bisect_right(self.starts, end + 1)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = array("q", [start])
+        self.ends[i:j] = array("q", [end])
+
+    def add(self, msg_id):
+        self.add_range(msg_id, msg_id)
+
+    def count(self, min_id=0, max_id=0):
+        """How many IDs fall in the inclusive range (0 means unbounded)"""
+        total = 0
+        for start, end in self.runs():
+            start = max(start, min_id)
+            end = min(end, max_id) if max_id else end
+            if end >= start:
+                total += end - start + 1
+        return total
+
+    def runs(self):
+        return zip(self.starts, self.ends)
+
+
+class SentStore:
+    """IDs already copied from one source channel to one target, plus the run's progress"""
+    # The .runs file is a snapshot of (start, end) int64 pairs; everything
+    # sent since is in a group-committed journal, with the progress of the
+    # run in the same records so the two never disagree after a crash.
+
+    def __init__(self, source_id, target_id, directory=SENT_DIR, progress_file=None, id_map=None):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{source_id}_{target_id}.runs")
+        self.progress_file = progress_file
+        self.progress = {}
+        self.ids = IdRuns()
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            data = array("q")
+            data.frombytes(raw[:len(raw) - len(raw) % RECORD_SIZE])
+            for k in range(0, len(data), 2):
+                self.ids.add_range(data[k], data[k + 1])
+        elif os.path.exists(LEGACY_LOG):
+            self._import_legacy()
+
+        self.journal = Journal(
+            os.path.join(directory, f"{source_id}_{target_id}.journal"),
+            snapshot=self.compact,
+            on_commit=self._publish_progress,
+            # Rows of the ID map go in with the sent IDs they belong to
+            before_commit=id_map.flush if id_map else None
+        )
+        for record in self.journal.replay():
+            for msg_id in record.get("sent", []):
+                self.ids.add(msg_id)
+            self.progress.update(record.get("progress", {}))
+
+    def _import_legacy(self):
+        # The old global log is taken over by the first pair opened after the
+        # upgrade and then renamed, so no other pair inherits its IDs
+        with open(LEGACY_LOG) as f:
+            for line in f:
+                if line.strip():
+                    self.ids.add(int(line))
+        self.compact()
+        os.replace(LEGACY_LOG, LEGACY_LOG + ".migrated")
+
+    def __contains__(self, msg_id):
+        return msg_id in self.ids
+
+    def count(self, min_id=0, max_id=0):
+        return self.ids.count(min_id, max_id)
+
+    def add(self, *msg_ids, progress=None):
+        """Record sent IDs and/or progress; durable at the journal's next group commit"""
+        record = {}
+        if msg_ids:
+            for msg_id in msg_ids:
+                self.ids.add(msg_id)
+            record["sent"] = list(msg_ids)
+        if progress:
+            self.progress.update(progress)
+            record["progress"] = progress
+        if record:
+            self.journal.append(record)
+
+    def _publish_progress(self):
+        # The bot reads a plain JSON view of the progress, refreshed once per commit
+        if not self.progress_file or not self.progress:
+            return
+        tmp_path = self.progress_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self.progress_file)
+
+    def compact(self):
+        """Rewrite the snapshot as one record per run, carrying the progress over to the journal"""
+        data = array("q")
+        for start, end in self.ids.runs():
+            data.extend((start, end))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return [{"progress": self.progress}] if self.progress else []
+
+    def close(self):
+        self.journal.compact()
+        self.journal.close()
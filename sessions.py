@@ -0,0 +1,62 @@
+import contextlib
+from rate_limit import HISTORY, SEND, limited
+
+
+class Account:
+    """One logged-in user session with its own view of the channels and its own limits"""
+
+    def __init__(self, client, source, target, limiter=None, primary=False):
+        self.client = client
+        self.source = source
+        self.target = target
+        self.limiter = limiter
+        self.primary = primary
+        self.in_flight = 0
+
+    def delay(self, kind=SEND):
+        return self.limiter.buckets[kind].delay() if self.limiter else 0.0
+
+    @contextlib.asynccontextmanager
+    async def busy(self):
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+
+    async def localize(self, msgs, files=None):
+        """This account's own copies of messages whose media it will send by reference"""
+        # Media references come with access hashes tied to the session that
+        # fetched them, so another account has to fetch the messages itself
+        files = files or [None] * len(msgs)
+        if self.primary or not any(msg.media and file is None for msg, file in zip(msgs, files)):
+            return msgs
+        fresh = await limited(self.limiter, HISTORY, self.client.get_messages, self.source,
+                              ids=[msg.id for msg in msgs])
+        return [new or old for new, old in zip(fresh, msgs)]
+
+
+class SessionPool:
+    """Accounts that are all admins of the target, sharing the send load"""
+
+    def __init__(self, accounts):
+        self.accounts = list(accounts)
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def add(self, account):
+        self.accounts.append(account)
+
+    def pick(self, kind=SEND):
+        """The account able to make a `kind` call soonest, FloodWaits included"""
+        return min(self.accounts, key=lambda account: (account.delay(kind), account.in_flight))
+
+    async def close(self):
+        for account in self.accounts:
+            if not account.primary:
+                await account.client.disconnect()
+
+    def __len__(self):
+        return len(self.accounts)
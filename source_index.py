@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+from telethon.tl.types import Message
+from history import HISTORY_LIMIT, MessageRef, iter_history
+
+INDEX_FILE = "source_index.db"
+
+
+def describe(channel_id, msg):
+    """Build the index row for a source message"""
+    media = msg.media
+    document = getattr(media, "document", None)
+    return (
+        channel_id,
+        msg.id,
+        int(msg.date.timestamp()) if msg.date else None,
+        msg.grouped_id,
+        type(media).__name__ if media else None,
+        msg.file.size if media and msg.file else None,
+        getattr(document, "id", None),
+        hashlib.sha1((msg.message or "").encode()).hexdigest(),
+    )
+
+class SourceIndex:
+    """Local metadata index of one source channel"""
+
+    def __init__(self, channel_id, path=INDEX_FILE):
+        self.channel_id = channel_id
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                channel_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                date INTEGER,
+                grouped_id INTEGER,
+                media_type TEXT,
+                file_size INTEGER,
+                document_id INTEGER,
+                text_hash TEXT,
+                PRIMARY KEY (channel_id, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sync_state (
+                channel_id INTEGER PRIMARY KEY,
+                high_water INTEGER NOT NULL
+            );
+        """)
+
+    @property
+    def high_water(self):
+        row = self.db.execute(
+            "SELECT high_water FROM sync_state WHERE channel_id = ?",
+            (self.channel_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add(self, messages, high_water=None):
+        """Store a page of messages and optionally advance the high-water mark"""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [describe(self.channel_id, m) for m in messages if isinstance(m, Message)]
+            )
+            if high_water is not None:
+                self.db.execute(
+                    "INSERT INTO sync_state VALUES (?, ?) "
+                    "ON CONFLICT(channel_id) DO UPDATE SET high_water = MAX(high_water, excluded.high_water)",
+                    (self.channel_id, high_water)
+                )
+
+    def _range(self, min_id, max_id):
+        return (
+            "channel_id = ? AND id >= ? AND id <= ?",
+            (self.channel_id, min_id or 0, max_id or (1 << 62)),
+        )
+
+    def count(self, min_id=0, max_id=0):
+        """Count indexed messages in the inclusive ID range"""
+        where, params = self._range(min_id, max_id)
+        return self.db.execute(f"SELECT COUNT(*) FROM messages WHERE {where}", params).fetchone()[0]
+
+    def refs(self, min_id=0, max_id=0, page_size=HISTORY_LIMIT):
+        """Yield MessageRefs for indexed messages oldest-first"""
+        last_id = (min_id or 1) - 1
+        while True:
+            where, params = self._range(last_id + 1, max_id)
+            rows = self.db.execute(
+                f"SELECT id, grouped_id, media_type, file_size FROM messages "
+                f"WHERE {where} ORDER BY id LIMIT ?",
+                params + (page_size,)
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield MessageRef(*row)
+            last_id = rows[-1][0]
+
+    async def sync(self, client, entity, min_id=0, max_id=0, limiter=None):
+        """Page history above the high-water mark into the index, yielding a MessageRef per message"""
+        # A range that starts past the indexed prefix is stored without moving
+        # the high-water mark, so it keeps meaning "everything below is indexed"
+        contiguous = min_id <= self.high_water + 1
+        start_id = self.high_water + 1 if contiguous else min_id
+
+        page = []
+        async for msg in iter_history(client, entity, start_id, max_id, limiter=limiter):
+            page.append(msg)
+            if len(page) >= HISTORY_LIMIT:
+                self.add(page, page[-1].id if contiguous else None)
+                page = []
+            if msg.id >= min_id and isinstance(msg, Message):
+                yield MessageRef.from_message(msg)
+        if page:
+            self.add(page, page[-1].id if contiguous else None)
+
+    async def stream(self, client, entity, min_id=0, max_id=0, limiter=None):
+        """Yield MessageRefs oldest-first, reading everything below the high-water mark locally"""
+        high_water = self.high_water
+        local_max = min(max_id, high_water) if max_id else high_water
+
+        if local_max:
+            for ref in self.refs(min_id, local_max):
+                yield ref
+
+        if not max_id or max_id > high_water:
+            async for ref in self.sync(client, entity, min_id, max_id, limiter):
+                yield ref
+
+    def close(self):
+        self.db.close()
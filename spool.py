@@ -0,0 +1,134 @@
+import asyncio
+import fcntl
+import os
+import tempfile
+
+# Spool settings
+SPOOL_DIR = "spool"
+SPOOL_LIMIT = 4 * 1024 * 1024 * 1024
+MEMORY_LIMIT = 20 * 1024 * 1024
+MEMORY_BUDGET = 128 * 1024 * 1024
+TEMP_PREFIX = "tmp-"
+LOCK_FILE = ".lock"
+
+
+class Spool:
+    """Size-capped directory for downloads too big to keep in memory"""
+    # Downloads kept in memory (up to memory_limit each) draw on a separate
+    # memory_budget the same way spooled files draw on the disk cap; the
+    # bytes object itself is what gets released.
+    # Named files left by an abandoned transfer stay on disk for a resume and
+    # count against the cap while idle; the oldest are deleted when a new
+    # reservation needs their room. Unnamed temp files are never resumed, so
+    # they go as soon as their transfer is done with them.
+
+    def __init__(self, path=SPOOL_DIR, limit=SPOOL_LIMIT, memory_limit=MEMORY_LIMIT, memory_budget=MEMORY_BUDGET):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.limit = limit
+        self.memory_limit = memory_limit
+        self.memory_budget = memory_budget
+        self.used = 0
+        self.memory_used = 0
+        self._sizes = {}
+        self._idle = {}
+        self._buffers = {}
+        self._freed = asyncio.Condition()
+        # Every Spool on the directory, in this process or another, holds a
+        # shared lock on it for as long as it lives. Only one that finds no
+        # other holder may clean up after earlier runs: temp files are
+        # dropped, named files are kept as idle, oldest first. Otherwise
+        # those files may belong to a transfer still in progress.
+        self._lock = open(os.path.join(path, LOCK_FILE), "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            entries = []
+        else:
+            entries = [os.path.join(path, name) for name in os.listdir(path) if name != LOCK_FILE]
+        for file_path in sorted(filter(os.path.isfile, entries), key=os.path.getmtime):
+            if os.path.basename(file_path).startswith(TEMP_PREFIX):
+                os.remove(file_path)
+            else:
+                self._idle[file_path] = os.path.getsize(file_path)
+                self.used += self._idle[file_path]
+        fcntl.flock(self._lock, fcntl.LOCK_SH)
+
+    def _fits(self, size):
+        # Idle files don't count, since they can be deleted to make room
+        active = self.used - sum(self._idle.values())
+        return not active or active + size <= self.limit
+
+    async def reserve(self, size, suffix=None, name=None):
+        """Wait for room, then return a file path in the spool"""
+        # A named file (and the checkpoint that goes with it) belongs to one
+        # transfer at a time; another transfer of the same document waits
+        # here until the first one has released or abandoned it
+        path = os.path.join(self.path, name) if name else None
+        async with self._freed:
+            # A file bigger than the whole cap still goes through, alone
+            await self._freed.wait_for(lambda: path not in self._sizes and self._fits(size))
+            # A resumed file's idle copy is taken over rather than counted twice
+            self.used += size - self._idle.pop(path, 0)
+            while self.used > self.limit and self._idle:
+                idle_path = next(iter(self._idle))
+                self.used -= self._idle.pop(idle_path)
+                if os.path.exists(idle_path):
+                    os.remove(idle_path)
+            if path:
+                self._sizes[path] = size
+        if path:
+            # Left as it is, so a resumed download can continue it
+            open(path, "ab").close()
+        else:
+            fd, path = tempfile.mkstemp(suffix=suffix or ".bin", prefix=TEMP_PREFIX, dir=self.path)
+            os.close(fd)
+            self._sizes[path] = size
+        return path
+
+    def memory_free(self, size):
+        return not self.memory_used or self.memory_used + size <= self.memory_budget
+
+    async def reserve_memory(self, size, wait=True):
+        """Take room in the memory budget for a download; without wait, False when there is none"""
+        async with self._freed:
+            if not wait and not self.memory_free(size):
+                return False
+            await self._freed.wait_for(lambda: self.memory_free(size))
+            self.memory_used += size
+        return True
+
+    def hold(self, data, size):
+        """Tie reserved memory to the downloaded bytes, so releasing them gives it back"""
+        self._buffers[id(data)] = size
+
+    async def release_memory(self, size):
+        async with self._freed:
+            self.memory_used -= size
+            self._freed.notify_all()
+
+    async def release(self, data):
+        """Delete a spooled file, or drop downloaded bytes, and give its room back"""
+        if isinstance(data, str) and os.path.exists(data):
+            os.remove(data)
+        await self.abandon(data)
+
+    async def abandon(self, path):
+        """Give a file's room back, keeping a named file on disk for a later resume"""
+        if isinstance(path, bytes):
+            size = self._buffers.pop(id(path), None)
+            if size is not None:
+                await self.release_memory(size)
+            return
+        size = self._sizes.pop(path, None)
+        if size is None:
+            return
+        async with self._freed:
+            self.used -= size
+            if os.path.exists(path):
+                if os.path.basename(path).startswith(TEMP_PREFIX):
+                    os.remove(path)
+                else:
+                    self._idle[path] = os.path.getsize(path)
+                    self.used += self._idle[path]
+            self._freed.notify_all()
@@ -0,0 +1,251 @@
+import os
+from telethon.errors import (
+    ChatForwardsRestrictedError,
+    FilePartMissingError,
+    FilePartsInvalidError,
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+)
+from telethon.helpers import generate_random_long
+from telethon.tl.functions.messages import ForwardMessagesRequest
+from telethon.tl.types import (
+    InputMediaUploadedDocument,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageMediaWebPage,
+    UpdateMessageID,
+)
+
+from parallel_transfer import (
+    CONNECTIONS,
+    PARALLEL_MIN_SIZE,
+    PART_SIZE,
+    CdnRedirect,
+    Checkpoint,
+    download_parallel,
+    upload_parallel,
+)
+from spool import Spool
+
+# Transfer modes
+REFERENCE_MODE = "reference"
+DOWNLOAD_MODE = "download"
+BULK_MODE = "bulk"
+
+FORWARD_BATCH = 100
+
+REFERENCE_ERRORS = (
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    FileReferenceEmptyError,
+    MediaEmptyError,
+)
+
+# The server dropped the parts of an upload before it was sent
+UPLOAD_ERRORS = (
+    FilePartMissingError,
+    FilePartsInvalidError,
+)
+
+
+def can_reference(source, msg):
+    """Check whether a message's media can be re-sent by server-side reference"""
+    if not isinstance(msg.media, (MessageMediaPhoto, MessageMediaDocument)):
+        return False
+    return not (getattr(source, "noforwards", False) or msg.noforwards)
+
+def needs_upload(source, msg, mode=REFERENCE_MODE):
+    """Check whether a message's media has to be downloaded and uploaded again"""
+    if not msg.media or isinstance(msg.media, MessageMediaWebPage):
+        return False
+    return not (mode == REFERENCE_MODE and can_reference(source, msg))
+
+def file_name(msg):
+    """A name Telethon can tell the file type from"""
+    return msg.file.name or f"{msg.id}{msg.file.ext or ''}"
+
+async def download(client, msg, spool, connections=CONNECTIONS, part_size=PART_SIZE, wait=True):
+    """Download a message's media into memory when small, otherwise into the spool"""
+    # Without wait, small media goes to the spool when the memory budget is
+    # spent, for callers that may hold up whoever would give memory back
+    size = msg.file.size or 0
+    if size <= spool.memory_limit and await spool.reserve_memory(size, wait):
+        try:
+            data = await client.download_media(msg, file=bytes)
+        except BaseException:
+            await spool.release_memory(size)
+            raise
+        spool.hold(data, size)
+        return data
+
+    if not (msg.document and connections > 1 and size >= PARALLEL_MIN_SIZE):
+        path = await spool.reserve(size, msg.file.ext)
+        try:
+            return await client.download_media(msg, file=path)
+        except BaseException:
+            await spool.release(path)
+            raise
+
+    # Big documents keep a stable spool name and a part checkpoint, so an
+    # interrupted run picks up from the last completed part
+    path = await spool.reserve(size, name=f"{msg.document.id}{msg.file.ext or '.bin'}")
+    checkpoint = Checkpoint(msg.document.id)
+    try:
+        try:
+            return await download_parallel(client, msg, path, connections, part_size, checkpoint)
+        except CdnRedirect:
+            # CDN-hosted files go through Telethon's downloader; anything else
+            # (FloodWaits, dropped connections, expired references) reaches the
+            # caller with the checkpoint intact, so the retry resumes
+            checkpoint.part_size = None
+            checkpoint.downloaded = set()
+            checkpoint.save()
+        return await client.download_media(msg, file=path)
+    except BaseException:
+        await spool.abandon(path)
+        raise
+
+async def upload(client, msg, data, connections=CONNECTIONS):
+    """Upload downloaded media (bytes or a spool path) without sending it"""
+    if isinstance(data, str) and connections > 1 and os.path.getsize(data) > PARALLEL_MIN_SIZE:
+        # Errors are left to the caller; the checkpoint keeps the parts already on the server
+        checkpoint = Checkpoint(msg.document.id) if msg.document else None
+        return await upload_parallel(client, data, connections, checkpoint)
+    return await client.upload_file(data, file_name=file_name(msg))
+
+async def reupload(client, msg, spool=None):
+    """Download a message's media and upload it again, returning the InputFile"""
+    # This runs at send time, so it must not wait on memory held by
+    # downloads queued up behind the send
+    spool = spool or Spool()
+    data = await download(client, msg, spool, wait=False)
+    try:
+        return await upload(client, msg, data)
+    finally:
+        await spool.release(data)
+
+async def send_by_reference(client, source, target, msg, caption, reply_to=None):
+    """Re-send photo/document media by file reference, refreshing it once if it expired"""
+    try:
+        return await client.send_file(target, msg.media, caption=caption, reply_to=reply_to)
+    except REFERENCE_ERRORS:
+        pass
+
+    # File references expire; a freshly fetched copy of the message carries a new one
+    fresh = await client.get_messages(source, ids=msg.id)
+    if not fresh or not fresh.media:
+        return None
+    try:
+        return await client.send_file(target, fresh.media, caption=caption, reply_to=reply_to)
+    except REFERENCE_ERRORS:
+        return None
+
+def forget_upload(msg):
+    """Drop a document's saved upload progress, so the next upload starts from scratch"""
+    if msg.document:
+        Checkpoint(msg.document.id).reset_upload()
+
+async def send_uploaded(client, target, msgs, file, **kwargs):
+    """send_file for media holding uploaded files, forgetting their uploads if the server lost the parts"""
+    try:
+        return await client.send_file(target, file, **kwargs)
+    except UPLOAD_ERRORS:
+        for msg in msgs:
+            forget_upload(msg)
+        raise
+
+async def copy_message(client, source, target, msg, mode=REFERENCE_MODE, uploaded=None, spool=None, reply_to=None):
+    """Send one source message to the target, reusing an already uploaded file if given"""
+    caption = msg.text or msg.message or ""
+    if not msg.media or isinstance(msg.media, MessageMediaWebPage):
+        if caption:
+            return await client.send_message(target, caption, reply_to=reply_to)
+        return None
+
+    if uploaded is not None:
+        return await send_uploaded(client, target, [msg], uploaded_media(msg, uploaded), caption=caption,
+                                   reply_to=reply_to)
+
+    if mode == REFERENCE_MODE and can_reference(source, msg):
+        try:
+            sent = await send_by_reference(client, source, target, msg, caption, reply_to)
+            if sent:
+                return sent
+        except ChatForwardsRestrictedError:
+            pass
+
+    uploaded = await reupload(client, msg, spool)
+    return await send_uploaded(client, target, [msg], uploaded_media(msg, uploaded), caption=caption,
+                               reply_to=reply_to)
+
+def uploaded_media(msg, uploaded=None):
+    """The media to send for a message: the uploaded file or the original reference"""
+    if uploaded is None:
+        return msg.media
+    document = msg.document
+    if not document:
+        return uploaded
+    # Built by hand so the original attributes and MIME type decide what it
+    # is; from a bare InputFile Telethon guesses by file name, turning image
+    # documents into compressed photos
+    return InputMediaUploadedDocument(
+        file=uploaded,
+        mime_type=document.mime_type,
+        attributes=document.attributes
+    )
+
+async def copy_album(client, source, target, msgs, uploaded=None, spool=None, reply_to=None):
+    """Send all members of a grouped_id album in one media-group call"""
+    uploaded = uploaded or [None] * len(msgs)
+    captions = [msg.text or msg.message or "" for msg in msgs]
+
+    try:
+        return await send_uploaded(
+            client, target, msgs, [uploaded_media(msg, file) for msg, file in zip(msgs, uploaded)],
+            caption=captions, reply_to=reply_to
+        )
+    except REFERENCE_ERRORS:
+        pass
+
+    # Refresh every member's file reference once, then fall back to
+    # re-uploading whatever still refuses to go by reference
+    fresh = await client.get_messages(source, ids=[msg.id for msg in msgs])
+    msgs = [new or old for new, old in zip(fresh, msgs)]
+    try:
+        return await send_uploaded(
+            client, target, msgs, [uploaded_media(msg, file) for msg, file in zip(msgs, uploaded)],
+            caption=captions, reply_to=reply_to
+        )
+    except REFERENCE_ERRORS:
+        pass
+
+    files = []
+    for msg, file in zip(msgs, uploaded):
+        if file is None:
+            file = await reupload(client, msg, spool)
+        files.append(uploaded_media(msg, file))
+    return await send_uploaded(client, target, msgs, files, caption=captions, reply_to=reply_to)
+
+async def forward_batch(client, source, target, ids, drop_captions=False):
+    """Copy up to FORWARD_BATCH messages in one call, returning {source_id: target_id}"""
+    # drop_author makes the result look like a copy rather than a forward.
+    # Captions are kept unless asked otherwise, since they are content.
+    ids = sorted(ids)
+    random_ids = [generate_random_long() for _ in ids]
+    result = await client(ForwardMessagesRequest(
+        from_peer=source,
+        id=ids,
+        to_peer=target,
+        random_id=random_ids,
+        drop_author=True,
+        drop_media_captions=drop_captions
+    ))
+
+    source_ids = dict(zip(random_ids, ids))
+    sent = {}
+    for update in getattr(result, "updates", []):
+        if isinstance(update, UpdateMessageID) and update.random_id in source_ids:
+            sent[source_ids[update.random_id]] = update.id
+    return sent
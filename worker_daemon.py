@@ -0,0 +1,277 @@
+import asyncio
+import argparse
+from telethon import utils
+from clone_worker import (REQUIRED_CONFIG, bot, close_accounts, config_spool, connect_accounts, log_error,
+                          normalize_channel_id, run_clone)
+from config_store import config_store
+from control import DAEMON_SOCKET, ControlServer, RunControl
+from jobs import DONE, FAILED, QUEUED, RUNNING, STOPPED, JobQueue
+from pipeline import STAGE_KINDS
+from progress import ProgressWriter
+from rate_limit import BACKGROUND, INTERACTIVE, PRIORITY_WEIGHTS, SEND, FairShare
+from sessions import Account, SessionPool
+
+MAX_JOBS = 3
+
+
+class AllJobs:
+    """Stop/pause/resume for every job at once, for the live-update chat commands"""
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def stop(self):
+        # Queued jobs are stopped too, or the next one would start straight away
+        self.daemon.preempted.clear()
+        for job in self.daemon.queue.jobs:
+            if job["status"] == QUEUED:
+                self.daemon.queue.set_status(job, STOPPED)
+        for control in self.daemon.controls.values():
+            control.stop()
+
+    def pause(self):
+        for control in self.daemon.controls.values():
+            control.pause()
+
+    def resume(self):
+        for control in self.daemon.controls.values():
+            control.resume()
+
+
+class WorkerDaemon:
+    """Resident clone worker: logged-in accounts shared by jobs from a persistent queue"""
+    # Up to max_jobs jobs run at once, as long as no two share a source or a
+    # target channel. Every job gets its own view of each account's limiter;
+    # the views share the account's buckets, so together the jobs stay at
+    # the account's limit, and draw on them in proportion to their priority.
+    # All jobs spool through the same Spool, so its disk and memory caps are
+    # for the daemon as a whole.
+    # An interactive job that clashes over a channel with background jobs, or
+    # finds every slot taken, stops them; they go back on the queue and pick
+    # up where they left off once it is done.
+
+    def __init__(self, queue, max_jobs=MAX_JOBS, spool=None):
+        self.queue = queue
+        self.max_jobs = max_jobs
+        self.spool = spool or config_spool(config_store.load())
+        self.accounts = None
+        self.accounts_key = None
+        self.shares = []
+        self.controls = {}
+        self.preempted = set()
+        self.tasks = set()
+        self.all_jobs = AllJobs(self)
+        self._connecting = asyncio.Lock()
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def handle(self, command):
+        """Answer one command from the daemon socket"""
+        cmd = command.get("cmd")
+        if cmd == "ping":
+            return {"ok": True}
+        if cmd == "submit":
+            source = command.get("source") or config_store.get("source_channel_id")
+            target = command.get("target") or config_store.get("target_channel_id")
+            if not source or not target:
+                return {"ok": False, "error": "No source or target channel"}
+            job = self.queue.submit(
+                chat_id=command.get("chat_id"),
+                source=normalize_channel_id(source),
+                target=normalize_channel_id(target),
+                start=command.get("start"),
+                end=command.get("end"),
+                replay=command.get("replay", False),
+                priority=command.get("priority", BACKGROUND)
+            )
+            self.wakeup.set()
+            return {"ok": True, "job": job}
+        if cmd == "jobs":
+            return {"ok": True, "jobs": self.queue.jobs}
+        if cmd in ("stop", "pause", "resume"):
+            # Without a job ID the command applies to every job; stop takes the queued ones too
+            if "job" not in command:
+                getattr(self.all_jobs, cmd)()
+                return {"ok": True}
+            job = self.queue.get(command["job"])
+            if not job:
+                return {"ok": False, "error": f"No job {command['job']}"}
+            control = self.controls.get(job["id"])
+            if cmd == "stop":
+                self.preempted.discard(job["id"])
+            if control:
+                getattr(control, cmd)()
+            elif cmd == "stop" and job["status"] == QUEUED:
+                self.queue.set_status(job, STOPPED)
+            return {"ok": True, "job": job}
+        if cmd in ("rate", "concurrency"):
+            value = command.get("value")
+            kind = command.get("kind", SEND)
+            if cmd == "concurrency":
+                # Every running job's stage takes the new worker count
+                if kind not in STAGE_KINDS:
+                    return {"ok": False, "error": f"Concurrency applies to {' and '.join(STAGE_KINDS)} only"}
+                for control in self.controls.values():
+                    control.resize(kind, value)
+            for share in self.shares:
+                await share.limiter.configure(
+                    kind,
+                    rate=value if cmd == "rate" else None,
+                    concurrency=value if cmd == "concurrency" else None
+                )
+            return {"ok": True}
+        if cmd == "shutdown":
+            # Replies once the running jobs have unwound; they stay queued for the next daemon
+            self.stopping = True
+            for control in self.controls.values():
+                control.stop()
+            self.wakeup.set()
+            await self.idle.wait()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown command: {cmd}"}
+
+    async def connect(self, config):
+        """The logged-in accounts, reconnecting when the login settings changed and no other job needs them"""
+        key = (config["api_id"], config["phone"], str(config.get("sessions", [])))
+        async with self._connecting:
+            if self.accounts and key != self.accounts_key and len(self.controls) <= 1:
+                await close_accounts(self.accounts)
+                self.accounts = None
+            if not self.accounts:
+                self.accounts = await connect_accounts(config)
+                self.accounts_key = key
+                self.shares = [FairShare(account.limiter) for account in self.accounts.accounts]
+            return self.accounts
+
+    async def job_accounts(self, config, job):
+        """Every account's view of the job's channels, drawing on a fair share of its limiter"""
+        accounts = await self.connect(config)
+        pool = []
+        for account, share in zip(accounts.accounts, self.shares):
+            # The configured pair is already resolved on every account
+            pair = (utils.get_peer_id(account.source), utils.get_peer_id(account.target))
+            if pair != (job["source"], job["target"]):
+                account = Account(account.client, await account.client.get_entity(job["source"]),
+                                  await account.client.get_entity(job["target"]), primary=account.primary)
+            pool.append(Account(account.client, account.source, account.target,
+                                share.job(job["priority"]), account.primary))
+        return SessionPool(pool)
+
+    def startable(self):
+        """Queued jobs to start now: higher priority first, none clashing over a channel"""
+        running = [job for job in self.queue.jobs if job["id"] in self.controls]
+        busy = {channel for job in running for channel in (job["source"], job["target"])}
+        queued = sorted(
+            (job for job in self.queue.jobs if job["status"] == QUEUED),
+            key=lambda job: (-PRIORITY_WEIGHTS.get(job["priority"], 1), job["id"])
+        )
+        picked = []
+        for job in queued:
+            full = len(running) + len(picked) >= self.max_jobs
+            if full or job["source"] in busy or job["target"] in busy:
+                if job["priority"] == INTERACTIVE:
+                    self.preempt(job, running, full)
+                continue
+            busy.update((job["source"], job["target"]))
+            picked.append(job)
+        return picked
+
+    def preempt(self, job, running, full):
+        """Stop the background jobs in an interactive job's way, to resume after it"""
+        channels = {job["source"], job["target"]}
+        clashing = [other for other in running if channels & {other["source"], other["target"]}]
+        if any(other["priority"] != BACKGROUND for other in clashing):
+            return
+        if not clashing and full:
+            # One slot is enough, and a job already on its way out frees it
+            if any(other["id"] in self.preempted for other in running):
+                return
+            clashing = [other for other in running if other["priority"] == BACKGROUND][-1:]
+        for other in clashing:
+            if other["id"] not in self.preempted:
+                self.preempted.add(other["id"])
+                self.controls[other["id"]].stop()
+
+    async def run_job(self, job, control):
+        reporter = bot.for_job(job["id"], job["chat_id"])
+        await reporter.send_initial_status()
+        reporter.progress.status("active", progress=0, total=0, current="Starting", chat_id=reporter.status_chat_id)
+        try:
+            config = config_store.load()
+            if not all(k in config for k in REQUIRED_CONFIG):
+                await reporter.update_status("❌ Missing configuration")
+                reporter.progress.status("error", current="Missing configuration")
+                return FAILED
+            try:
+                accounts = await self.job_accounts(config, job)
+            except Exception as e:
+                await reporter.update_status(f"❌ Channel access failed: {str(e)}")
+                reporter.progress.status("error", current=f"Channel access failed: {str(e)}")
+                return FAILED
+
+            await run_clone(accounts, config, job["start"], job["end"], job["replay"], control, reporter,
+                            self.spool)
+            if not control.stopped:
+                return DONE
+            if job["id"] in self.preempted:
+                await reporter.update_status("⏸ Paused for a range clone; carries on once it is done")
+                return QUEUED
+            return QUEUED if self.stopping else STOPPED
+        except Exception as e:
+            log_error(f"Job {job['id']} failed: {str(e)}")
+            reporter.progress.status("error", current=str(e))
+            return FAILED
+        finally:
+            reporter.stop_publishing()
+
+    async def _job(self, job, control):
+        status = await self.run_job(job, control)
+        self.queue.set_status(job, status)
+        del self.controls[job["id"]]
+        self.preempted.discard(job["id"])
+        if not self.controls:
+            bot.is_cloning = False
+            self.idle.set()
+        self.wakeup.set()
+
+    async def run(self):
+        while not self.stopping:
+            self.wakeup.clear()
+            for job in self.startable():
+                control = RunControl()
+                self.controls[job["id"]] = control
+                self.queue.set_status(job, RUNNING)
+                self.idle.clear()
+                bot.is_cloning = True
+                task = asyncio.create_task(self._job(job, control))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            await self.wakeup.wait()
+        await self.idle.wait()
+
+
+async def main(progress_fd=None):
+    bot.progress = ProgressWriter(progress_fd)
+    if not await bot.initialize():
+        print("❌ Bot initialization failed")
+        return
+
+    daemon = WorkerDaemon(JobQueue(), config_store.get_int("max_jobs", MAX_JOBS))
+    bot.control = daemon.all_jobs
+    server = await ControlServer(daemon.handle, config_store.get_str("daemon_socket", DAEMON_SOCKET)).start()
+    try:
+        await daemon.run()
+    finally:
+        await server.close()
+        if daemon.accounts:
+            await close_accounts(daemon.accounts)
+        await bot.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--progress_fd", type=int, help="descriptor to write JSON-lines progress events to")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.progress_fd))